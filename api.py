@@ -1,31 +1,67 @@
 from flask import Flask, request
-from flask.json.provider import DefaultJSONProvider
 from views.anime import anime_bp
 from views.ep import ep_bp
 from views.season import season_bp
+from views.category import category_bp
+from views.health import health_bp
+from views.changes import changes_bp
+from views.jobs import jobs_bp
 from api_spec import spec
-from database import db
+from database import db, engine_options_from_env, replica_binds_from_env
+from migrations import db_cli
+from utils.compression import init_compression
+from utils.metrics import TimedJSONProvider, init_metrics
+from utils.ratelimit import init_rate_limits
+from utils.replicas import init_replicas
+from utils.writebehind import init_write_behind
 import os
 """
 /anime                                                                  GET - POST
 /anime/<int:anime_id>                                                   GET - PUT - DELETE
+/anime/<int:anime_id>/full                                              GET
+/anime/bulk                                                             POST
+/anime/search?q=                                                        GET
 
 /anime/<int:anime_id>/season                                            GET - POST
 /anime/<int:anime_id>/season/<int:season_num>                           GET - POST - DELETE
 
 /anime/<int:anime_id>/season/<int:season_num>/episode                   GET - POST
 /anime/<int:anime_id>/season/<int:season_num>/episode/<int:ep_num>      GET - PUT - DELETE
+/anime/<int:anime_id>/season/<int:season_num>/episode/bulk              POST
+
+/episodes?ids=                                                          GET
+/episodes/recent?limit=&before=                                         GET
+
+/categories                                                             GET
+
+/changes?since=                                                         GET
+/jobs/<job_id>                                                          GET
+
+/health/pool                                                            GET
+/metrics                                                                GET
 """
 
 app = Flask(__name__)
 app.config["SQLALCHEMY_DATABASE_URI"] = os.getenv('DATABASEURI')
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options_from_env(os.getenv('DATABASEURI'))
+app.config["SQLALCHEMY_BINDS"] = replica_binds_from_env()
 db.init_app(app)
+init_replicas(app)
+app.cli.add_command(db_cli)
 spec.register(app)
-DefaultJSONProvider.ensure_ascii = False
+app.json = TimedJSONProvider(app)
+init_metrics(app)
+init_compression(app)
+init_write_behind(app)
+init_rate_limits(app)
 
 app.register_blueprint(anime_bp)
 app.register_blueprint(season_bp)
 app.register_blueprint(ep_bp)
+app.register_blueprint(category_bp)
+app.register_blueprint(health_bp)
+app.register_blueprint(changes_bp)
+app.register_blueprint(jobs_bp)
 
 if __name__ == '__main__':
     app.run(debug=True, host='localhost', port=5000)
@@ -1,3 +1,4 @@
 from flask_pydantic_spec import FlaskPydanticSpec
+from utils.metrics import TimedFlaskBackend
 
-spec = FlaskPydanticSpec('flask', title='Anime Scraping API')
+spec = FlaskPydanticSpec('flask', backend=TimedFlaskBackend, title='Anime Scraping API')
@@ -0,0 +1,12 @@
+"""
+Benchmarks. Seeds a database with a synthetic catalog and measures every
+route of the anime, season and episode blueprints, in process through the
+Flask test client and over HTTP against `serve.py`.
+
+    python -m bench.run --database sqlite:////tmp/bench.db --animes 2000
+    python -m bench.run --database sqlite:////tmp/bench.db --out new.json --baseline old.json
+
+Results (throughput and p50/p95/p99 latency per route) go to a JSON file;
+with --baseline the run is compared against a previous one and exits with
+status 1 when a route regressed beyond --tolerance.
+"""
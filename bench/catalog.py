@@ -0,0 +1,84 @@
+"""
+Synthetic catalog: `animes` × `seasons` × `episodes`, generated from a
+fixed seed so every run measures the same data.
+"""
+
+import datetime
+import random
+from sqlalchemy import func, select
+from database import anime, db, episode
+from migrations import upgrade
+from utils.categories import sync_categories
+from utils.search import sync_search_index
+from utils.summary import rebuild_season_summary
+
+CATEGORIES = [
+    'Ação', 'Aventura', 'Comédia', 'Drama', 'Escolar', 'Esporte', 'Fantasia',
+    'Ficção Científica', 'Mistério', 'Romance', 'Shounen', 'Slice of Life', 'Terror',
+]
+WORDS = [
+    'academia', 'batalha', 'caçador', 'cidade', 'dragão', 'escola', 'espada', 'guerra',
+    'herói', 'ilha', 'magia', 'mundo', 'ninja', 'pirata', 'reino', 'robô', 'segredo',
+    'sombra', 'torneio', 'viagem',
+]
+INSERT_BATCH = 1000
+
+
+def generate_animes(rng, animes):
+    for n in range(1, animes + 1):
+        yield {
+            'name': f"{rng.choice(WORDS).title()} {rng.choice(WORDS).title()} {n}",
+            'year': str(rng.randint(1990, 2024)),
+            'sinopse': ' '.join(rng.choice(WORDS) for _ in range(30)),
+            'categories': ', '.join(rng.sample(CATEGORIES, rng.randint(1, 4))),
+            'rate': round(rng.uniform(1, 10), 1),
+            'url': f'https://animes.example/anime/{n}',
+        }
+
+
+def generate_episodes(anime_id, seasons, episodes):
+    start = datetime.date(2000, 1, 1) + datetime.timedelta(days=anime_id)
+    for season in range(1, seasons + 1):
+        for number in range(1, episodes + 1):
+            yield {
+                'anime_id': anime_id,
+                'season': season,
+                'number': number,
+                'date': start + datetime.timedelta(weeks=(season - 1) * episodes + number),
+                'url': f'https://animes.example/anime/{anime_id}/{season}/{number}',
+            }
+
+
+def insert_batched(table, rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == INSERT_BATCH:
+            db.session.execute(table.insert(), batch)
+            batch = []
+    if batch:
+        db.session.execute(table.insert(), batch)
+
+
+def seed(animes, seasons, episodes, seed=0):
+    """Migrate the database and fill it with the catalog. Must run inside an
+    app context; an already seeded database is left as is."""
+    upgrade()
+    existing = db.session.execute(select(func.count()).select_from(anime)).scalar()
+    if existing:
+        return False
+
+    rng = random.Random(seed)
+    rows = list(generate_animes(rng, animes))
+    insert_batched(anime, rows)
+
+    ids = db.session.execute(select(anime.c.id, anime.c.categories).order_by(anime.c.id)).fetchall()
+    for anime_id, categories in ids:
+        sync_categories(anime_id, categories)
+    sync_search_index(*[anime_id for anime_id, _ in ids])
+    insert_batched(episode, (
+        ep for anime_id, _ in ids for ep in generate_episodes(anime_id, seasons, episodes)
+    ))
+    rebuild_season_summary()
+    db.session.commit()
+    return True
@@ -0,0 +1,372 @@
+"""
+Benchmark runner, see `bench`.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# `build(ctx, i, target)` returns the (path, json body) of the i-th request.
+# `targets(ctx)` lists the rows a write works on, the scenario then runs at
+# most once per target.
+Scenario = namedtuple('Scenario', 'name method build targets', defaults=(None,))
+
+
+def random_anime(ctx):
+    return ctx.rng.randint(1, ctx.animes)
+
+
+def random_season(ctx):
+    return random_anime(ctx), ctx.rng.randint(1, ctx.seasons)
+
+
+def random_episode(ctx):
+    return (*random_season(ctx), ctx.rng.randint(1, ctx.episodes))
+
+
+def uses_orjson(app):
+    """Whether a JSON response of `app` (what jsonify builds) is encoded by
+    orjson rather than by the stdlib fallback."""
+    from utils import serialization
+    real = serialization.orjson
+    if real is None:
+        return False
+
+    calls = []
+
+    class Spy:
+        def __getattr__(self, name):
+            return getattr(real, name)
+
+        def dumps(self, *args, **kwargs):
+            calls.append(1)
+            return real.dumps(*args, **kwargs)
+
+    serialization.orjson = Spy()
+    try:
+        with app.test_request_context():
+            app.json.response({'check': True})
+    finally:
+        serialization.orjson = real
+    return bool(calls)
+
+
+def bench_anime(ctx, name):
+    return {
+        'name': name, 'year': '2024', 'sinopse': 'benchmark ninja escola',
+        'categories': 'Ação, Comédia', 'rate': 5.0, 'url': f'bench://{ctx.run}/{name}',
+    }
+
+
+READS = [
+    Scenario('list_animes', 'GET', lambda ctx, i, _: (f'/anime?limit=50&after={random_anime(ctx) - 1}', None)),
+    Scenario('list_animes_fields', 'GET', lambda ctx, i, _: (f'/anime?limit=50&after={random_anime(ctx) - 1}&fields=id,name', None)),
+    Scenario('list_animes_category', 'GET', lambda ctx, i, _: (f"/anime?limit=50&category={quote(ctx.rng.choice(ctx.categories))}", None)),
+    Scenario('list_animes_ids', 'GET', lambda ctx, i, _: (
+        '/anime?ids=' + ','.join(str(random_anime(ctx)) for _ in range(20)), None
+    )),
+    Scenario('list_animes_ndjson', 'GET', lambda ctx, i, _: ('/anime?format=ndjson', None)),
+    Scenario('search_anime', 'GET', lambda ctx, i, _: (f"/anime/search?q={quote(ctx.rng.choice(ctx.words))}", None)),
+    Scenario('get_anime', 'GET', lambda ctx, i, _: (f'/anime/{random_anime(ctx)}', None)),
+    Scenario('get_anime_full', 'GET', lambda ctx, i, _: (f'/anime/{random_anime(ctx)}/full', None)),
+    Scenario('list_seasons', 'GET', lambda ctx, i, _: (f'/anime/{random_anime(ctx)}/season', None)),
+    Scenario('get_season', 'GET', lambda ctx, i, _: ('/anime/{}/season/{}'.format(*random_season(ctx)), None)),
+    Scenario('list_eps', 'GET', lambda ctx, i, _: ('/anime/{}/season/{}/episode'.format(*random_season(ctx)), None)),
+    Scenario('get_ep', 'GET', lambda ctx, i, _: ('/anime/{}/season/{}/episode/{}'.format(*random_episode(ctx)), None)),
+    Scenario('get_eps_by_id', 'GET', lambda ctx, i, _: (
+        '/episodes?ids=' + ','.join(str(ctx.rng.randint(1, ctx.total_episodes)) for _ in range(20)), None
+    )),
+    Scenario('recent_eps', 'GET', lambda ctx, i, _: ('/episodes/recent?limit=50', None)),
+]
+
+# in order: the later writes work on the rows created by the earlier ones,
+# and the last one removes them
+WRITES = [
+    Scenario('add_anime', 'POST', lambda ctx, i, _: ('/anime', bench_anime(ctx, f'single-{i}'))),
+    Scenario('modify_anime', 'PUT', lambda ctx, i, aid: (f'/anime/{aid}', bench_anime(ctx, f'single-{i}-v2')),
+             lambda ctx: ctx.bench_animes()),
+    Scenario('upsert_animes', 'POST', lambda ctx, i, _: (
+        '/anime/bulk', [bench_anime(ctx, f'bulk-{i}-{n}') for n in range(50)]
+    )),
+    Scenario('add_ep', 'POST', lambda ctx, i, aid: (f'/anime/{aid}/season/1/episode', {
+        'id': 0, 'anime_id': aid, 'number': i, 'season': 1, 'date': '2024-01-01', 'url': f'bench://{ctx.run}/ep/{i}',
+    }), lambda ctx: ctx.bench_animes()),
+    Scenario('add_bulk_eps', 'POST', lambda ctx, i, aid: (f'/anime/{aid}/season/2/episode/bulk', [
+        {'number': n, 'date': '2024-01-01', 'url': f'bench://{ctx.run}/ep/{i}/{n}'} for n in range(1, 51)
+    ]), lambda ctx: ctx.bench_animes()),
+    Scenario('modify_ep', 'PUT', lambda ctx, i, ep: ('/anime/{1}/season/{2}/episode/{3}'.format(*ep), {
+        'id': ep[0], 'anime_id': ep[1], 'season': ep[2], 'number': ep[3], 'date': '2024-02-01', 'url': f'bench://{ctx.run}/ep/{i}/v2',
+    }), lambda ctx: ctx.bench_episodes()),
+    Scenario('delete_ep', 'DELETE', lambda ctx, i, ep: ('/anime/{1}/season/{2}/episode/{3}'.format(*ep), None),
+             lambda ctx: ctx.bench_episodes()),
+    Scenario('delete_anime', 'DELETE', lambda ctx, i, aid: (f'/anime/{aid}', None), lambda ctx: ctx.bench_animes()),
+]
+
+
+class Context:
+    def __init__(self, app, animes, seasons, episodes, seed):
+        from bench.catalog import CATEGORIES, WORDS
+        self.app = app
+        self.animes = animes
+        self.seasons = seasons
+        self.episodes = episodes
+        self.total_episodes = animes * seasons * episodes
+        self.categories = CATEGORIES
+        self.words = WORDS
+        self.rng = random.Random(seed)
+        self.run = f'{int(time.time())}-{os.getpid()}'
+
+    def query(self, sql, params):
+        from sqlalchemy import text
+        from database import db
+        with self.app.app_context():
+            return db.session.execute(text(sql), params).fetchall()
+
+    def bench_animes(self):
+        rows = self.query('SELECT id FROM anime WHERE url LIKE :url ORDER BY id', {'url': f'bench://{self.run}/%'})
+        return [aid for aid, in rows]
+
+    def bench_episodes(self):
+        return self.query(
+            'SELECT e.id, e.anime_id, e.season, e.number FROM episode e JOIN anime a ON a.id = e.anime_id \
+                WHERE a.url LIKE :url AND e.season = 1 ORDER BY e.id',
+            {'url': f'bench://{self.run}/%'}
+        )
+
+
+def client_sender(app, token):
+    local = threading.local()
+
+    def send(method, path, body):
+        if not hasattr(local, 'client'):
+            local.client = app.test_client()
+        response = local.client.open(path, method=method, json=body, headers={'X-Access-Token': token})
+        response.get_data()
+        response.close()
+        return response.status_code
+    return send
+
+
+def http_sender(base_url, token):
+    def send(method, path, body):
+        data = json.dumps(body).encode() if body is not None else None
+        req = urllib.request.Request(base_url + path, data=data, method=method, headers={
+            'X-Access-Token': token, 'Content-Type': 'application/json',
+        })
+        try:
+            with urllib.request.urlopen(req, timeout=60) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            e.read()
+            return e.code
+    return send
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of sorted `values`."""
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, round(p / 100 * len(values)) - 1))]
+
+
+def run_scenario(send, scenario, ctx, requests, concurrency):
+    targets = scenario.targets(ctx) if scenario.targets else [None] * requests
+    jobs = [(i, *scenario.build(ctx, i, target)) for i, target in enumerate(targets[:requests])]
+    latencies, statuses = [], Counter()
+    lock = threading.Lock()
+
+    def one(job):
+        i, path, body = job
+        start = time.perf_counter()
+        try:
+            status = send(scenario.method, path, body)
+        except Exception as e:
+            status = type(e).__name__
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            statuses[str(status)] += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(one, jobs))
+    seconds = time.perf_counter() - start
+
+    latencies.sort()
+    ms = lambda value: round(value * 1000, 3) if value is not None else None
+    return {
+        'requests': len(jobs),
+        'errors': sum(n for status, n in statuses.items() if not status.isdigit() or int(status) >= 500),
+        'statuses': dict(statuses),
+        'seconds': round(seconds, 3),
+        'throughput_rps': round(len(jobs) / seconds, 1) if seconds else None,
+        'mean_ms': ms(sum(latencies) / len(latencies)) if latencies else None,
+        'p50_ms': ms(percentile(latencies, 50)),
+        'p95_ms': ms(percentile(latencies, 95)),
+        'p99_ms': ms(percentile(latencies, 99)),
+    }
+
+
+def run_all(send, ctx, args):
+    results = {}
+    for scenario in READS + ([] if args.read_only else WRITES):
+        results[scenario.name] = run_scenario(send, scenario, ctx, args.requests, args.concurrency)
+        print(f"  {scenario.name:24} {results[scenario.name]['throughput_rps']:>9} rps  "
+              f"p50 {results[scenario.name]['p50_ms']} ms  p99 {results[scenario.name]['p99_ms']} ms", file=sys.stderr)
+
+    # the bulk upserts create more rows than delete_anime gets to remove,
+    # leave the catalog as the next run expects it
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        list(pool.map(lambda aid: send('DELETE', f'/anime/{aid}', None), ctx.bench_animes()))
+    return results
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+@contextlib.contextmanager
+def http_server(server_mode):
+    port = free_port()
+    env = {**os.environ, 'HOST': '127.0.0.1', 'PORT': str(port), 'SERVER_MODE': server_mode}
+    proc = subprocess.Popen(
+        [sys.executable, 'serve.py'], cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        deadline = time.time() + 30
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                break
+            except OSError:
+                if proc.poll() is not None or time.time() > deadline:
+                    raise RuntimeError('servidor HTTP não iniciou')
+                time.sleep(0.2)
+        yield f'http://127.0.0.1:{port}'
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def compare(results, baseline, tolerance):
+    """Print the change of every route against `baseline`, returning the
+    regressions (p95 or throughput worse than `tolerance`)."""
+    regressions = []
+    print(f"{'mode':6} {'route':24} {'p50':>8} {'p95':>8} {'p99':>8} {'rps':>8}")
+    for mode, routes in results['results'].items():
+        for name, new in routes.items():
+            old = baseline.get('results', {}).get(mode, {}).get(name)
+            if not old:
+                continue
+            change = {}
+            for key in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps'):
+                change[key] = (new[key] / old[key] - 1) if old.get(key) and new.get(key) is not None else None
+            cells = ' '.join(f'{c:>+8.1%}' if c is not None else f"{'-':>8}" for c in change.values())
+            print(f'{mode:6} {name:24} {cells}')
+            if (change['p95_ms'] or 0) > tolerance or (change['throughput_rps'] or 0) < -tolerance:
+                regressions.append(f'{mode} {name}')
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m bench.run', description=__doc__)
+    parser.add_argument('--database', default=os.getenv('DATABASEURI'), help='SQLAlchemy URI of a scratch database')
+    parser.add_argument('--animes', type=int, default=1000)
+    parser.add_argument('--seasons', type=int, default=3)
+    parser.add_argument('--episodes', type=int, default=12)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--requests', type=int, default=200, help='requests per route')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--mode', choices=('client', 'http', 'both'), default='both')
+    parser.add_argument('--server', choices=('threaded', 'gevent'), default='threaded', help='SERVER_MODE for --mode http')
+    parser.add_argument('--read-only', action='store_true', help='skip the write routes')
+    parser.add_argument('--out', default='bench-results.json')
+    parser.add_argument('--baseline', help='results of a previous run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='allowed p95/throughput regression, 0.10 = 10%%')
+    args = parser.parse_args(argv)
+    if not args.database:
+        parser.error('--database or DATABASEURI is required')
+
+    # configure the app before importing it, the HTTP server inherits the same environment
+    os.environ['DATABASEURI'] = args.database
+    if os.getenv('READ_CACHE', 'sqlite') == 'sqlite' and not os.getenv('READ_CACHE_PATH'):
+        os.environ['READ_CACHE_PATH'] = os.path.join(tempfile.mkdtemp(prefix='bench-cache-'), 'cache.sqlite3')
+    # the access keys are read at import; the bench client would trip the rate limits
+    token = os.environ.setdefault('SECRET_KEY', 'bench')
+    os.environ.setdefault('RATE_LIMIT', 'false')
+    sys.path.insert(0, ROOT)
+    from api import app
+    from bench.catalog import seed
+    from database import db
+    from utils.serialization import orjson
+
+    # the read numbers are meaningless if responses silently take the slow encoder
+    if orjson is not None and not uses_orjson(app):
+        print('orjson is installed but JSON responses are not encoded with it', file=sys.stderr)
+        return 1
+
+    with app.app_context():
+        print('seeding catalog...' if seed(args.animes, args.seasons, args.episodes, args.seed)
+              else 'using the catalog already in the database', file=sys.stderr)
+        dialect = db.engine.dialect.name
+
+    ctx = Context(app, args.animes, args.seasons, args.episodes, args.seed)
+    results = {
+        'meta': {
+            'database': dialect,
+            'animes': args.animes, 'seasons': args.seasons, 'episodes': args.episodes,
+            'requests': args.requests, 'concurrency': args.concurrency,
+            'server': args.server, 'read_cache': os.getenv('READ_CACHE', 'sqlite'),
+            'python': platform.python_version(),
+            'commit': subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True
+            ).stdout.strip() or None,
+            'started_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        },
+        'results': {},
+    }
+
+    if args.mode in ('client', 'both'):
+        print('test client', file=sys.stderr)
+        # the views print their request bodies
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            results['results']['client'] = run_all(client_sender(app, token), ctx, args)
+    if args.mode in ('http', 'both'):
+        print(f'http ({args.server})', file=sys.stderr)
+        with http_server(args.server) as base_url:
+            results['results']['http'] = run_all(http_sender(base_url, token), ctx, args)
+
+    with open(args.out, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'results written to {args.out}', file=sys.stderr)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print('regressions: ' + ', '.join(regressions), file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,5 +1,181 @@
+import os
+import sqlite3
+import threading
+import time
+from flask import g, has_request_context
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from sqlalchemy.orm import declarative_base
+from sqlalchemy.pool import QueuePool
+
+
+class RoutingSession(Session):
+    """Session that sends the statements of a request to the bind chosen for
+    it in `g.db_bind` (a read replica, see `utils.replicas`), or to the
+    primary when none was chosen."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_request_context() and g.get('db_bind'):
+            return self._db.engines[g.db_bind]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(Engine, 'connect')
+def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    # SQLite ignores the schema's ON DELETE CASCADE unless asked per connection
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA foreign_keys=ON')
+        cursor.close()
+
 
 Base = declarative_base()
-db = SQLAlchemy(model_class=Base)
+db = SQLAlchemy(model_class=Base, session_options={'class_': RoutingSession})
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long checkouts wait for a connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.waiting = 0
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def connect(self):
+        start = time.perf_counter()
+        with self._stats_lock:
+            self.waiting += 1
+        try:
+            return super().connect()
+        except PoolTimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._stats_lock:
+                self.waiting -= 1
+                self.checkouts += 1
+                self.wait_seconds += elapsed
+                self.max_wait_seconds = max(self.max_wait_seconds, elapsed)
+
+    def stats(self):
+        return {
+            'size': self.size(),
+            'checked_out': self.checkedout(),
+            'checked_in': self.checkedin(),
+            # QueuePool counts down from -pool_size until the pool is full
+            'overflow': max(0, self.overflow()),
+            'waiting': self.waiting,
+            'checkouts': self.checkouts,
+            'timeouts': self.timeouts,
+            'avg_wait_ms': self.wait_seconds / self.checkouts * 1000 if self.checkouts else 0.0,
+            'max_wait_ms': self.max_wait_seconds * 1000,
+        }
+
+
+def engine_options_from_env(uri):
+    """SQLALCHEMY_ENGINE_OPTIONS from the DB_POOL_* and DB_STATEMENT_TIMEOUT
+    variables. Unset variables keep the SQLAlchemy defaults."""
+    uri = uri or ''
+    if uri.startswith('sqlite') and (uri in ('sqlite://', 'sqlite:///') or ':memory:' in uri):
+        return {}
+
+    options = {'poolclass': TimedQueuePool}
+    for var, option, cast in (
+        ('DB_POOL_SIZE', 'pool_size', int),
+        ('DB_MAX_OVERFLOW', 'max_overflow', int),
+        ('DB_POOL_TIMEOUT', 'pool_timeout', float),
+        ('DB_POOL_RECYCLE', 'pool_recycle', int),
+    ):
+        if os.getenv(var):
+            options[option] = cast(os.getenv(var))
+
+    options['pool_pre_ping'] = os.getenv('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes')
+
+    # milliseconds, enforced server side
+    if os.getenv('DB_STATEMENT_TIMEOUT') and uri.startswith('postgresql'):
+        options['connect_args'] = {'options': f"-c statement_timeout={int(os.getenv('DB_STATEMENT_TIMEOUT'))}"}
+    return options
+
+
+def replica_binds_from_env():
+    """SQLALCHEMY_BINDS for the comma separated DATABASE_REPLICA_URIS, one
+    `replica_<n>` bind per URI with the same pool options as the primary."""
+    uris = [uri.strip() for uri in os.getenv('DATABASE_REPLICA_URIS', '').split(',') if uri.strip()]
+    return {
+        f'replica_{n}': {'url': uri, **engine_options_from_env(uri)}
+        for n, uri in enumerate(uris)
+    }
+
+
+# Current schema. Databases are created and converted by the versioned
+# scripts in `migrations`, never from this metadata directly.
+anime = db.Table(
+    'anime',
+    db.Column('id', db.Integer, primary_key=True),
+    db.Column('name', db.String(255)),
+    db.Column('year', db.String(16)),
+    db.Column('sinopse', db.Text),
+    db.Column('categories', db.Text),
+    db.Column('rate', db.Float),
+    db.Column('url', db.String(512)),
+    db.Column('updated_at', db.DateTime(timezone=True)),
+    db.Index('ux_anime_url', 'url', unique=True),
+)
+
+episode = db.Table(
+    'episode',
+    db.Column('id', db.Integer, primary_key=True),
+    db.Column('anime_id', db.Integer, db.ForeignKey('anime.id', ondelete='CASCADE'), nullable=False),
+    db.Column('number', db.Integer, nullable=False),
+    db.Column('date', db.Date),
+    db.Column('season', db.Integer, nullable=False),
+    db.Column('url', db.String(512)),
+    db.Column('updated_at', db.DateTime(timezone=True)),
+    db.Index('ix_episode_anime_season_number', 'anime_id', 'season', 'number'),
+    db.Index('ix_episode_date_id', 'date', 'id'),
+)
+
+# Cheap per-resource counters bumped by the write handlers, used to build ETags
+resource_version = db.Table(
+    'resource_version',
+    db.Column('resource', db.String(64), primary_key=True),
+    db.Column('version', db.Integer, nullable=False, default=0),
+)
+
+# Episode count per (anime_id, season), kept up to date by the episode write handlers
+season_summary = db.Table(
+    'season_summary',
+    db.Column('anime_id', db.Integer, primary_key=True),
+    db.Column('season', db.Integer, primary_key=True),
+    db.Column('episodes', db.Integer, nullable=False, default=0),
+)
+
+# Outbox of anime and episode writes, read by GET /changes. The id is the cursor.
+change_log = db.Table(
+    'change_log',
+    db.Column('id', db.Integer, primary_key=True),
+    db.Column('resource', db.String(16), nullable=False),
+    db.Column('resource_id', db.Integer, nullable=False),
+    db.Column('anime_id', db.Integer, nullable=False),
+    db.Column('op', db.String(8), nullable=False),
+    db.Column('changed_at', db.DateTime(timezone=True), nullable=False),
+    sqlite_autoincrement=True,
+)
+
+# Write-behind jobs already applied, recorded in the job's own transaction
+# so a replayed job is skipped
+applied_job = db.Table(
+    'applied_job',
+    db.Column('id', db.String(32), primary_key=True),
+    db.Column('applied_at', db.DateTime(timezone=True), nullable=False),
+    db.Index('ix_applied_job_applied_at', 'applied_at'),
+)
@@ -0,0 +1,89 @@
+"""
+Versioned schema migrations.
+
+Each `vNNNN_<name>.py` module in this package defines `upgrade(conn)`,
+which receives a SQLAlchemy connection inside a transaction. Applied
+versions are recorded in the schema_version table.
+
+    flask --app api db upgrade
+    flask --app api db current
+"""
+
+import importlib
+import pkgutil
+import click
+from flask.cli import AppGroup
+from sqlalchemy import Column, Integer, MetaData, String, Table, select
+from database import db
+
+metadata = MetaData()
+schema_version = Table(
+    'schema_version',
+    metadata,
+    Column('version', Integer, primary_key=True),
+    Column('name', String(128), nullable=False),
+)
+
+
+def available():
+    """(version, name, module) for every migration, in order."""
+    found = []
+    for info in pkgutil.iter_modules(__path__):
+        if info.name.startswith('v') and info.name[1:5].isdigit():
+            module = importlib.import_module(f'{__name__}.{info.name}')
+            found.append((int(info.name[1:5]), info.name, module))
+    return sorted(found, key=lambda m: m[0])
+
+
+def applied():
+    with db.engine.begin() as conn:
+        schema_version.create(conn, checkfirst=True)
+        return set(conn.execute(select(schema_version.c.version)).scalars())
+
+
+def upgrade():
+    """Apply every pending migration, each one in its own transaction."""
+    done = applied()
+    ran = []
+    with db.engine.connect() as conn:
+        sqlite = conn.dialect.name == 'sqlite'
+        if sqlite:
+            # table rebuilds must neither cascade nor check the rows they
+            # copy; the pragma is a no-op inside a transaction
+            conn.exec_driver_sql('PRAGMA foreign_keys=OFF')
+            conn.commit()
+        try:
+            for version, name, module in available():
+                if version in done:
+                    continue
+                with conn.begin():
+                    module.upgrade(conn)
+                    conn.execute(schema_version.insert().values(version=version, name=name))
+                ran.append(name)
+        finally:
+            if sqlite:
+                conn.rollback()
+                conn.exec_driver_sql('PRAGMA foreign_keys=ON')
+                conn.commit()
+    return ran
+
+
+db_cli = AppGroup('db', help='Database schema migrations.')
+
+
+@db_cli.command('upgrade')
+def upgrade_command():
+    """Apply pending migrations."""
+    ran = upgrade()
+    for name in ran:
+        click.echo(f'applied {name}')
+    if not ran:
+        click.echo('schema is up to date')
+
+
+@db_cli.command('current')
+def current_command():
+    """Show applied and pending migrations."""
+    done = applied()
+    for version, name, _ in available():
+        click.echo(f"{name}{'' if version in done else ' (pending)'}")
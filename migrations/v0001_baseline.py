@@ -0,0 +1,95 @@
+"""Tables the API relies on. Existing tables are left untouched, except for
+anime rows sharing a url (re-scrapes before the url was unique), which are
+merged into the first of them so the unique index can be built."""
+
+from sqlalchemy import Column, Date, Float, ForeignKey, Integer, MetaData, String, Table, Text, inspect, text
+
+metadata = MetaData()
+
+anime = Table(
+    'anime',
+    metadata,
+    Column('id', Integer, primary_key=True),
+    Column('name', String(255)),
+    Column('year', String(16)),
+    Column('sinopse', Text),
+    Column('categories', Text),
+    Column('rate', Float),
+    Column('url', String(512)),
+)
+
+episode = Table(
+    'episode',
+    metadata,
+    Column('id', Integer, primary_key=True),
+    Column('anime_id', Integer, ForeignKey('anime.id', ondelete='CASCADE'), nullable=False),
+    Column('number', Integer, nullable=False),
+    Column('date', Date),
+    Column('season', Integer, nullable=False),
+    Column('url', String(512)),
+)
+
+resource_version = Table(
+    'resource_version',
+    metadata,
+    Column('resource', String(64), primary_key=True),
+    Column('version', Integer, nullable=False, default=0),
+)
+
+season_summary = Table(
+    'season_summary',
+    metadata,
+    Column('anime_id', Integer, primary_key=True),
+    Column('season', Integer, primary_key=True),
+    Column('episodes', Integer, nullable=False, default=0),
+)
+
+
+def dedupe_urls(conn):
+    """Keep the lowest id of each url. The other rows' episodes move to it,
+    except the (season, number) it already has, and so do their category
+    links; then the rows go."""
+    pairs = [
+        {'dupe': dupe, 'keep': keep} for dupe, keep in conn.execute(text(
+            'SELECT a.id, k.keep FROM anime a JOIN ( \
+                SELECT url, min(id) AS keep FROM anime WHERE url IS NOT NULL GROUP BY url HAVING count(*) > 1 \
+            ) k ON a.url = k.url WHERE a.id <> k.keep'
+        ))
+    ]
+    if not pairs:
+        return
+
+    tables = set(inspect(conn).get_table_names())
+    conn.execute(text(
+        'DELETE FROM episode WHERE anime_id = :dupe AND EXISTS ( \
+            SELECT 1 FROM episode k WHERE k.anime_id = :keep AND k.season = episode.season AND k.number = episode.number)'
+    ), pairs)
+    conn.execute(text('UPDATE episode SET anime_id = :keep WHERE anime_id = :dupe'), pairs)
+
+    if 'anime_category' in tables:
+        conn.execute(text(
+            'INSERT INTO anime_category (anime_id, category_id) \
+                SELECT :keep, category_id FROM anime_category WHERE anime_id = :dupe ON CONFLICT DO NOTHING'
+        ), pairs)
+        conn.execute(text('DELETE FROM anime_category WHERE anime_id = :dupe'), pairs)
+        conn.execute(text(
+            'UPDATE category SET animes = (SELECT count(*) FROM anime_category ac WHERE ac.category_id = category.id)'
+        ))
+    if 'anime_fts' in tables:
+        conn.execute(text('DELETE FROM anime_fts WHERE rowid = :dupe'), pairs)
+    if 'season_summary' in tables:
+        keepers = [{'keep': keep} for keep in {p['keep'] for p in pairs}]
+        conn.execute(text('DELETE FROM season_summary WHERE anime_id = :dupe'), pairs)
+        conn.execute(text('DELETE FROM season_summary WHERE anime_id = :keep'), keepers)
+        conn.execute(text(
+            'INSERT INTO season_summary (anime_id, season, episodes) \
+                SELECT anime_id, season, count(*) FROM episode WHERE anime_id = :keep GROUP BY anime_id, season'
+        ), keepers)
+
+    conn.execute(text('DELETE FROM anime WHERE id = :dupe'), pairs)
+
+
+def upgrade(conn):
+    metadata.create_all(conn, checkfirst=True)
+    dedupe_urls(conn)
+    conn.execute(text('CREATE UNIQUE INDEX IF NOT EXISTS ux_anime_url ON anime (url)'))
@@ -0,0 +1,46 @@
+"""Convert episode.season/number to integers and episode.date to a date,
+in place, for databases created before the columns were typed."""
+
+from sqlalchemy import Column, Date, ForeignKey, Integer, MetaData, String, Table, inspect, text
+
+TYPED = {'season': Integer, 'number': Integer, 'date': Date}
+
+
+def untyped_columns(conn):
+    columns = {c['name']: c['type'] for c in inspect(conn).get_columns('episode')}
+    return [name for name, kind in TYPED.items() if not isinstance(columns[name], kind)]
+
+
+def upgrade(conn):
+    columns = untyped_columns(conn)
+    if not columns:
+        return
+
+    if conn.dialect.name == 'postgresql':
+        sql_types = {'season': 'INTEGER', 'number': 'INTEGER', 'date': 'DATE'}
+        alters = ', '.join(
+            f'ALTER COLUMN {c} TYPE {sql_types[c]} USING {c}::{sql_types[c].lower()}' for c in columns
+        )
+        conn.execute(text(f'ALTER TABLE episode {alters}'))
+        return
+
+    # SQLite can't change a column type, the table is rebuilt instead
+    metadata = MetaData()
+    Table('anime', metadata, Column('id', Integer, primary_key=True))
+    episode_new = Table(
+        'episode_new',
+        metadata,
+        Column('id', Integer, primary_key=True),
+        Column('anime_id', Integer, ForeignKey('anime.id', ondelete='CASCADE'), nullable=False),
+        Column('number', Integer, nullable=False),
+        Column('date', Date),
+        Column('season', Integer, nullable=False),
+        Column('url', String(512)),
+    )
+    episode_new.create(conn)
+    conn.execute(text(
+        'INSERT INTO episode_new (id, anime_id, number, date, season, url) \
+            SELECT id, anime_id, CAST(number AS INTEGER), date, CAST(season AS INTEGER), url FROM episode'
+    ))
+    conn.execute(text('DROP TABLE episode'))
+    conn.execute(text('ALTER TABLE episode_new RENAME TO episode'))
@@ -0,0 +1,10 @@
+"""Indexes behind the episode lookups and the date ordering."""
+
+from sqlalchemy import text
+
+
+def upgrade(conn):
+    conn.execute(text(
+        'CREATE INDEX IF NOT EXISTS ix_episode_anime_season_number ON episode (anime_id, season, number)'
+    ))
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_episode_date ON episode (date)'))
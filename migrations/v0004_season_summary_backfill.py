@@ -0,0 +1,11 @@
+"""Fill season_summary for episodes that predate it."""
+
+from sqlalchemy import text
+
+
+def upgrade(conn):
+    conn.execute(text('DELETE FROM season_summary'))
+    conn.execute(text(
+        'INSERT INTO season_summary (anime_id, season, episodes) \
+            SELECT anime_id, season, count(*) FROM episode GROUP BY anime_id, season'
+    ))
@@ -0,0 +1,25 @@
+"""Full-text index over anime name, categories and sinopse: a generated
+tsvector with a GIN index on Postgres, an FTS5 table elsewhere."""
+
+from sqlalchemy import text
+
+
+def upgrade(conn):
+    if conn.dialect.name == 'postgresql':
+        conn.execute(text(
+            "ALTER TABLE anime ADD COLUMN IF NOT EXISTS search tsvector GENERATED ALWAYS AS ( \
+                setweight(to_tsvector('portuguese', coalesce(name, '')), 'A') || \
+                setweight(to_tsvector('portuguese', coalesce(categories, '')), 'B') || \
+                setweight(to_tsvector('portuguese', coalesce(sinopse, '')), 'C')) STORED"
+        ))
+        conn.execute(text('CREATE INDEX IF NOT EXISTS ix_anime_search ON anime USING GIN (search)'))
+        return
+
+    conn.execute(text(
+        'CREATE VIRTUAL TABLE IF NOT EXISTS anime_fts USING fts5(name, categories, sinopse)'
+    ))
+    conn.execute(text('DELETE FROM anime_fts'))
+    conn.execute(text(
+        'INSERT INTO anime_fts (rowid, name, categories, sinopse) \
+            SELECT id, name, categories, sinopse FROM anime'
+    ))
@@ -0,0 +1,43 @@
+"""Normalized categories: one row per category with a precomputed anime
+count, linked to anime through anime_category. Backfilled from the
+comma separated anime.categories column."""
+
+from sqlalchemy import Column, ForeignKey, Index, Integer, MetaData, String, Table, text
+
+metadata = MetaData()
+Table('anime', metadata, Column('id', Integer, primary_key=True))
+
+category = Table(
+    'category',
+    metadata,
+    Column('id', Integer, primary_key=True),
+    Column('name', String(128), nullable=False, unique=True),
+    Column('animes', Integer, nullable=False, default=0),
+)
+
+anime_category = Table(
+    'anime_category',
+    metadata,
+    Column('anime_id', Integer, ForeignKey('anime.id', ondelete='CASCADE'), primary_key=True),
+    Column('category_id', Integer, ForeignKey('category.id', ondelete='CASCADE'), primary_key=True),
+    Index('ix_anime_category_category', 'category_id', 'anime_id'),
+)
+
+
+def upgrade(conn):
+    category.create(conn, checkfirst=True)
+    anime_category.create(conn, checkfirst=True)
+
+    links = {}
+    for anime_id, categories in conn.execute(text('SELECT id, categories FROM anime')):
+        for name in {c.strip() for c in (categories or '').split(',') if c.strip()}:
+            links.setdefault(name, []).append(anime_id)
+
+    for name, anime_ids in links.items():
+        category_id = conn.execute(
+            category.insert().values(name=name, animes=len(anime_ids)).returning(category.c.id)
+        ).scalar()
+        conn.execute(
+            anime_category.insert(),
+            [{'anime_id': anime_id, 'category_id': category_id} for anime_id in anime_ids]
+        )
@@ -0,0 +1,38 @@
+"""Change feed: updated_at on anime and episode, and the change_log outbox
+the write handlers append to. Every existing row gets an upsert entry, so
+a mirror can make its first sync from the feed too."""
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, inspect, text
+
+metadata = MetaData()
+
+change_log = Table(
+    'change_log',
+    metadata,
+    Column('id', Integer, primary_key=True),
+    Column('resource', String(16), nullable=False),
+    Column('resource_id', Integer, nullable=False),
+    Column('anime_id', Integer, nullable=False),
+    Column('op', String(8), nullable=False),
+    Column('changed_at', DateTime(timezone=True), nullable=False),
+    # cursors must never be reused after old entries are pruned
+    sqlite_autoincrement=True,
+)
+
+
+def upgrade(conn):
+    for table in ('anime', 'episode'):
+        columns = {c['name'] for c in inspect(conn).get_columns(table)}
+        if 'updated_at' not in columns:
+            conn.execute(text(f'ALTER TABLE {table} ADD COLUMN updated_at TIMESTAMP WITH TIME ZONE'))
+        conn.execute(text(f'UPDATE {table} SET updated_at = CURRENT_TIMESTAMP WHERE updated_at IS NULL'))
+
+    change_log.create(conn, checkfirst=True)
+    conn.execute(text(
+        "INSERT INTO change_log (resource, resource_id, anime_id, op, changed_at) \
+            SELECT 'anime', id, id, 'upsert', CURRENT_TIMESTAMP FROM anime ORDER BY id"
+    ))
+    conn.execute(text(
+        "INSERT INTO change_log (resource, resource_id, anime_id, op, changed_at) \
+            SELECT 'episode', id, anime_id, 'upsert', CURRENT_TIMESTAMP FROM episode ORDER BY id"
+    ))
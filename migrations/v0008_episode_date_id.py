@@ -0,0 +1,10 @@
+"""Date index extended with the id, so GET /episodes/recent reads its
+(date, id) keyset order straight from the index. It replaces
+ix_episode_date, which it covers."""
+
+from sqlalchemy import text
+
+
+def upgrade(conn):
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_episode_date_id ON episode (date, id)'))
+    conn.execute(text('DROP INDEX IF EXISTS ix_episode_date'))
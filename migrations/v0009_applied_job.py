@@ -0,0 +1,18 @@
+"""Ids of the write-behind jobs already applied, so replaying a job after a
+crash or an expired lease doesn't apply it twice."""
+
+from sqlalchemy import Column, DateTime, Index, MetaData, String, Table
+
+metadata = MetaData()
+
+applied_job = Table(
+    'applied_job',
+    metadata,
+    Column('id', String(32), primary_key=True),
+    Column('applied_at', DateTime(timezone=True), nullable=False),
+    Index('ix_applied_job_applied_at', 'applied_at'),
+)
+
+
+def upgrade(conn):
+    applied_job.create(conn, checkfirst=True)
@@ -1,4 +1,4 @@
-from pydantic import BaseModel, ValidationError, validator
+from pydantic import BaseModel, Field, ValidationError, validator
 from typing import Optional, Literal
 import datetime
 
@@ -15,6 +15,30 @@ class Anime(BaseModel):
 
 class Animes(BaseModel):
     animes: list[Anime]
+    next_cursor: Optional[int]
+    missing: Optional[list[int]]
+
+
+class FieldsQuery(BaseModel):
+    fields: Optional[str]
+
+
+class AnimeQuery(FieldsQuery):
+    limit: Optional[int] = Field(None, ge=1)
+    after: Optional[int] = Field(None, ge=0)
+    category: Optional[str]
+    ids: Optional[str]
+
+
+class SearchQuery(FieldsQuery):
+    q: str = Field(..., min_length=1)
+    limit: Optional[int] = Field(None, ge=1)
+    offset: Optional[int] = Field(None, ge=0)
+
+
+class AnimeSearch(BaseModel):
+    animes: list[Anime]
+    next_offset: Optional[int]
 
 
 class Episode(BaseModel):
@@ -37,7 +61,7 @@ class Episode(BaseModel):
 
     @validator('season', pre=True, always=True)
     def parse_season(cls, value):
-        if not isinstance(value, int):
+        if value is not None and not isinstance(value, int):
             try:
                 return int(value)
             except ValueError as e:
@@ -47,6 +71,25 @@ class Episode(BaseModel):
 
 class Episodes(BaseModel):
     episodes: list[Episode]
+    missing: Optional[list[int]]
+
+
+class EpisodeIdsQuery(FieldsQuery):
+    ids: str
+
+
+class RecentQuery(BaseModel):
+    limit: Optional[int] = Field(None, ge=1)
+    before: Optional[str]
+
+
+class RecentEpisode(Episode):
+    anime_name: Optional[str]
+
+
+class RecentEpisodes(BaseModel):
+    episodes: list[RecentEpisode]
+    next_before: Optional[str]
 
 
 class Season(BaseModel):
@@ -63,6 +106,88 @@ class SeasonEpisodes(BaseModel):
     episodes: list[Episode]
 
 
+class RowError(BaseModel):
+    index: int
+    message: str
+
+
+class BulkResult(BaseModel):
+    status_code: int
+    inserted: int
+    errors: list[RowError]
+
+
+class UpsertResult(BaseModel):
+    status_code: int
+    inserted: int
+    updated: int
+    unchanged: int
+    errors: list[RowError]
+
+
+class Category(BaseModel):
+    name: str
+    animes: int
+
+
+class Categories(BaseModel):
+    categories: list[Category]
+
+
+class AnimeFull(BaseModel):
+    anime: Anime
+    seasons: list[SeasonEpisodes]
+
+
+class PoolStats(BaseModel):
+    size: int
+    checked_out: int
+    checked_in: int
+    overflow: int
+    waiting: Optional[int]
+    checkouts: Optional[int]
+    timeouts: Optional[int]
+    avg_wait_ms: Optional[float]
+    max_wait_ms: Optional[float]
+
+
+class ChangesQuery(BaseModel):
+    since: Optional[int] = Field(None, ge=0)
+    limit: Optional[int] = Field(None, ge=1)
+
+
+class Change(BaseModel):
+    cursor: int
+    resource: Literal['anime', 'episode']
+    id: int
+    anime_id: int
+    op: Literal['upsert', 'delete']
+    changed_at: str
+    data: Optional[dict]
+
+
+class Changes(BaseModel):
+    changes: list[Change]
+    next_since: int
+    has_more: bool
+
+
+class Job(BaseModel):
+    id: str
+    kind: str
+    status: Literal['queued', 'running', 'done', 'failed']
+    error: Optional[str]
+    created_at: str
+    finished_at: Optional[str]
+
+
+class JobAccepted(BaseModel):
+    status_code: int
+    message_type: Literal['info']
+    message: str
+    job_id: str
+
+
 class JsonResponseMessage(BaseModel):
     status_code: int
     message_type: Literal['info', 'error', 'success']
@@ -0,0 +1,65 @@
+"""
+Serving entry point.
+
+    python serve.py                         threaded server
+    SERVER_MODE=gevent python serve.py      cooperative server
+
+In gevent mode the standard library and the Postgres driver are made
+cooperative before the app is imported, so every view keeps its sync
+code and pydantic contracts while a single process holds thousands of
+concurrent requests waiting on the database. Size DB_POOL_SIZE and
+DB_MAX_OVERFLOW for the concurrency you expect, since requests queue on
+the connection pool instead of on worker threads.
+"""
+
+import os
+from dotenv import load_dotenv
+load_dotenv()
+
+SERVER_MODE = os.getenv('SERVER_MODE', 'threaded')
+HOST = os.getenv('HOST', 'localhost')
+PORT = int(os.getenv('PORT', 5000))
+MAX_CONNECTIONS = int(os.getenv('MAX_CONNECTIONS', 10000))
+
+if SERVER_MODE == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+
+
+def gevent_wait_callback(conn, timeout=None):
+    """psycopg2 wait callback yielding to the gevent hub while the
+    connection waits on the socket."""
+    from psycopg2 import OperationalError, extensions
+    from gevent.socket import wait_read, wait_write
+
+    while True:
+        state = conn.poll()
+        if state == extensions.POLL_OK:
+            break
+        elif state == extensions.POLL_READ:
+            wait_read(conn.fileno(), timeout=timeout)
+        elif state == extensions.POLL_WRITE:
+            wait_write(conn.fileno(), timeout=timeout)
+        else:
+            raise OperationalError(f'Bad result from poll: {state!r}')
+
+
+def make_psycopg_green():
+    try:
+        from psycopg2 import extensions
+    except ImportError:
+        return
+    extensions.set_wait_callback(gevent_wait_callback)
+
+
+if __name__ == '__main__':
+    if SERVER_MODE == 'gevent':
+        from gevent.pool import Pool
+        from gevent.pywsgi import WSGIServer
+        make_psycopg_green()
+
+        from api import app
+        WSGIServer((HOST, PORT), app, spawn=Pool(MAX_CONNECTIONS)).serve_forever()
+    else:
+        from api import app
+        app.run(host=HOST, port=PORT, threaded=True)
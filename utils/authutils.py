@@ -1,9 +1,35 @@
+import hmac
 import os
 from dotenv import load_dotenv
 load_dotenv()
 
-def validate_auth(headers):
+
+def load_keys():
+    """Access keys from SECRET_KEYS (comma separated, so a key can be
+    rotated without downtime) and SECRET_KEY."""
+    keys = [key.strip() for key in os.getenv('SECRET_KEYS', '').split(',') if key.strip()]
+    if os.getenv('SECRET_KEY'):
+        keys.append(os.getenv('SECRET_KEY'))
+    return tuple(key.encode() for key in dict.fromkeys(keys))
+
+
+# read once at startup, the workers must be restarted to pick up new keys
+ACCESS_KEYS = load_keys()
+
+
+def key_index(headers):
+    """Position in ACCESS_KEYS of the key sent in X-Access-Token, or None."""
     token = headers.get('X-Access-Token')
-    if token != os.getenv('SECRET_KEY'):
-        return False
-    return True
+    if not token:
+        return None
+
+    # every key is compared, so the timing doesn't tell which one matched
+    match = None
+    for i, key in enumerate(ACCESS_KEYS):
+        if hmac.compare_digest(token.encode(), key):
+            match = i
+    return match
+
+
+def validate_auth(headers):
+    return key_index(headers) is not None
@@ -0,0 +1,247 @@
+"""
+Read cache for the hot lookups. Keys:
+
+anime:<anime_id>                        get_anime
+seasons:<anime_id>                      list_seasons
+eps:<anime_id>:<season>                 list_eps
+ep:<anime_id>:<season>:<number>         get_ep
+
+Values must be JSON serializable. Each is stored with the resource versions
+the view's ETag was computed from (`utils.etag.cache_version`) and only
+served to requests at those same versions, so a body loaded before a write
+can't go out under the ETag of the version after it. Write handlers still
+call `invalidate` / `invalidate_prefix` after committing, to free the space. Concurrent misses on the same key in
+a process run the loader once (utils/singleflight.py).
+
+The cache never fails a request: a backend error is logged and taken as a
+miss, or ignored by `set` and the invalidations (a write has already
+committed when it invalidates).
+"""
+
+import json
+import logging
+import os
+import queue
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+from utils.singleflight import flights
+from dotenv import load_dotenv
+load_dotenv()
+
+log = logging.getLogger(__name__)
+
+
+class ReadCache:
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        raise NotImplementedError
+
+    def invalidate(self, *keys):
+        raise NotImplementedError
+
+    def invalidate_prefix(self, *prefixes):
+        raise NotImplementedError
+
+    def fetch(self, key, loader, version, ttl=None):
+        """Return the value cached for `key` at `version`, calling `loader`
+        on a miss. A loader returning None (not found) is not cached, and
+        with `version` None the cache isn't used at all. Callers missing the
+        same key at the same time share one loader call and its value, which
+        they must not modify."""
+        if version is None:
+            return loader()
+
+        entry = self.get(key)
+        if isinstance(entry, list) and len(entry) == 2 and entry[0] == version:
+            return entry[1]
+        value, _ = flights.do(f'cache:{key}:{version}', lambda: self._load(key, loader, version, ttl))
+        return value
+
+    def _load(self, key, loader, version, ttl):
+        value = loader()
+        if value is not None:
+            self.set(key, [version, value], ttl)
+        return value
+
+
+class NullCache(ReadCache):
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl=None):
+        pass
+
+    def invalidate(self, *keys):
+        pass
+
+    def invalidate_prefix(self, *prefixes):
+        pass
+
+
+class MemoryCache(ReadCache):
+    """Per-process LRU, for single worker setups and local runs."""
+
+    def __init__(self, max_entries=10000, ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (time.time() + (ttl or self.ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def invalidate(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def invalidate_prefix(self, *prefixes):
+        with self._lock:
+            for key in [k for k in self._data if k.startswith(prefixes)]:
+                del self._data[key]
+
+
+def fail_open(default=None):
+    """Log backend errors of the decorated method and return `default`."""
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            try:
+                return method(self, *args, **kwargs)
+            except sqlite3.Error as e:
+                log.warning('read cache %s failed: %s', method.__name__, e)
+                return default
+        return wrapper
+    return decorator
+
+
+class SQLiteCache(ReadCache):
+    """LRU shared by every worker process on the host through a WAL-mode
+    SQLite file. Recency is tracked in TOUCH_EVERY second steps, so most
+    hits only read and don't contend for the file's write lock."""
+
+    EVICT_EVERY = 100
+    TOUCH_EVERY = 10
+
+    def __init__(self, path, max_entries=10000, ttl=60):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._sets = 0
+        self._pid = None
+        self._idle = None
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS cache ('
+            'key TEXT PRIMARY KEY, value TEXT NOT NULL, '
+            'expires_at REAL NOT NULL, accessed_at REAL NOT NULL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS ix_cache_accessed ON cache (accessed_at)')
+        return conn
+
+    @contextmanager
+    def conn(self):
+        # connections are pooled per process (they can't cross a fork), so
+        # threads and greenlets reuse them instead of opening one each
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._idle = queue.LifoQueue()
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self.connect()
+        try:
+            yield conn
+        finally:
+            self._idle.put(conn)
+
+    @fail_open()
+    def get(self, key):
+        now = time.time()
+        with self.conn() as conn:
+            row = conn.execute(
+                'SELECT value, accessed_at FROM cache WHERE key = ? AND expires_at > ?', (key, now)
+            ).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.TOUCH_EVERY:
+                conn.execute('UPDATE cache SET accessed_at = ? WHERE key = ?', (now, key))
+        return json.loads(row[0])
+
+    @fail_open()
+    def set(self, key, value, ttl=None):
+        now = time.time()
+        with self.conn() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)',
+                (key, json.dumps(value), now + (ttl or self.ttl), now)
+            )
+        self._sets += 1
+        if self._sets % self.EVICT_EVERY == 0:
+            self.evict()
+
+    @fail_open()
+    def evict(self):
+        with self.conn() as conn:
+            conn.execute('DELETE FROM cache WHERE expires_at <= ?', (time.time(),))
+            conn.execute(
+                'DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed_at '
+                'LIMIT max(0, (SELECT count(*) FROM cache) - ?))',
+                (self.max_entries,)
+            )
+
+    @fail_open()
+    def invalidate(self, *keys):
+        with self.conn() as conn:
+            conn.executemany('DELETE FROM cache WHERE key = ?', [(k,) for k in keys])
+
+    @fail_open()
+    def invalidate_prefix(self, *prefixes):
+        with self.conn() as conn:
+            conn.executemany(
+                'DELETE FROM cache WHERE key >= ? AND key < ?',
+                [(p, p + '\uffff') for p in prefixes]
+            )
+
+
+def make_cache():
+    backend = os.getenv('READ_CACHE', 'sqlite')
+    max_entries = int(os.getenv('READ_CACHE_SIZE', 10000))
+    ttl = float(os.getenv('READ_CACHE_TTL', 60))
+
+    if backend == 'sqlite':
+        path = os.getenv('READ_CACHE_PATH', os.path.join(tempfile.gettempdir(), 'animesonline-cache.sqlite3'))
+        return SQLiteCache(path, max_entries, ttl)
+    if backend == 'memory':
+        return MemoryCache(max_entries, ttl)
+    return NullCache()
+
+
+read_cache = make_cache()
@@ -0,0 +1,71 @@
+from sqlalchemy import bindparam, text
+from database import db
+
+
+def parse_categories(value):
+    """'Ação, Comédia' -> ['Ação', 'Comédia']"""
+    names = []
+    for name in (value or '').split(','):
+        name = name.strip()
+        if name and name not in names:
+            names.append(name)
+    return names
+
+
+def sync_categories(anime_id, categories):
+    """Point `anime_id` at exactly the categories in the `categories` string
+    and keep the per-category counts in step. Runs in the caller's transaction;
+    on delete it must run before the anime row is removed."""
+    sync_categories_many({anime_id: categories})
+
+
+def sync_categories_many(categories_by_anime):
+    """`sync_categories` for every {anime_id: categories} item. Category rows
+    are written once each, in id order (names for new ones), so concurrent
+    transactions lock them in the same order and can't deadlock."""
+    wanted = {anime_id: parse_categories(categories) for anime_id, categories in categories_by_anime.items()}
+    names = sorted({name for anime_names in wanted.values() for name in anime_names})
+    ids = {}
+    if names:
+        db.session.execute(
+            text("INSERT INTO category (name, animes) VALUES (:name, 0) ON CONFLICT (name) DO NOTHING"),
+            [{'name': name} for name in names]
+        )
+        ids = dict(db.session.execute(
+            text("SELECT name, id FROM category WHERE name IN :names").bindparams(bindparam('names', expanding=True)),
+            {'names': names}
+        ).fetchall())
+
+    current = {anime_id: set() for anime_id in wanted}
+    for anime_id, cid in db.session.execute(
+        text("SELECT anime_id, category_id FROM anime_category WHERE anime_id IN :aids")
+            .bindparams(bindparam('aids', expanding=True)),
+        {'aids': list(wanted)}
+    ):
+        current[anime_id].add(cid)
+
+    added, removed, deltas = [], [], {}
+    for anime_id, anime_names in wanted.items():
+        cids = {ids[name] for name in anime_names}
+        for cid in cids - current[anime_id]:
+            added.append({'aid': anime_id, 'cid': cid})
+            deltas[cid] = deltas.get(cid, 0) + 1
+        for cid in current[anime_id] - cids:
+            removed.append({'aid': anime_id, 'cid': cid})
+            deltas[cid] = deltas.get(cid, 0) - 1
+
+    if removed:
+        db.session.execute(text("DELETE FROM anime_category WHERE anime_id = :aid AND category_id = :cid"), removed)
+    if added:
+        db.session.execute(text("INSERT INTO anime_category (anime_id, category_id) VALUES (:aid, :cid)"), added)
+    counts = [{'cid': cid, 'delta': delta} for cid, delta in sorted(deltas.items()) if delta]
+    if counts:
+        db.session.execute(text("UPDATE category SET animes = animes + :delta WHERE id = :cid"), counts)
+
+
+def category_filter(names):
+    """SQL condition on anime.id matching animes that have every category in
+    `names`, with its bind parameters."""
+    sql = "id IN (SELECT ac.anime_id FROM anime_category ac JOIN category c ON c.id = ac.category_id \
+        WHERE c.name IN :category_names GROUP BY ac.anime_id HAVING count(*) = :category_count)"
+    return sql, {'category_names': names, 'category_count': len(names)}
@@ -0,0 +1,25 @@
+from sqlalchemy import text
+from database import db
+from utils.search import is_postgres
+
+# pg_advisory_xact_lock key serializing the change log writers
+CHANGE_LOG_LOCK = 7306
+
+
+def record_changes(resource, op, rows):
+    """Append `rows` of (id, anime_id) to the change log as `op` ('upsert' or
+    'delete') of `resource`. Runs in the caller's transaction."""
+    if not rows:
+        return
+    if is_postgres():
+        # held until commit, so cursors are handed out in commit order and a
+        # reader that sees an entry sees every entry before it (SQLite has a
+        # single writer already)
+        db.session.execute(text('SELECT pg_advisory_xact_lock(:k)'), {'k': CHANGE_LOG_LOCK})
+    db.session.execute(
+        text(
+            "INSERT INTO change_log (resource, resource_id, anime_id, op, changed_at) \
+                VALUES (:resource, :id, :aid, :op, CURRENT_TIMESTAMP)"
+        ),
+        [{'resource': resource, 'id': row_id, 'aid': anime_id, 'op': op} for row_id, anime_id in rows]
+    )
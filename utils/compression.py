@@ -0,0 +1,164 @@
+"""
+Response compression negotiated from Accept-Encoding: brotli when the
+`brotli` package is installed and the client accepts it, otherwise gzip.
+Bodies smaller than COMPRESS_MIN_SIZE bytes go out as they are. Streamed
+responses are compressed as they are generated.
+
+A compressed response gets the ETag of its view with the encoding appended
+("<tag>-gzip"), and its body is kept in a per-process LRU under that tag, so
+the next request for the same representation is answered from it by the
+`etag` decorator without running the view or compressing again.
+"""
+
+import gzip
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from flask import Response, request
+from dotenv import load_dotenv
+load_dotenv()
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ENABLED = os.getenv('COMPRESS', 'true').lower() in ('1', 'true', 'yes')
+MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', 1024))
+GZIP_LEVEL = int(os.getenv('COMPRESS_GZIP_LEVEL', 6))
+BROTLI_LEVEL = int(os.getenv('COMPRESS_BROTLI_LEVEL', 5))
+CACHE_BYTES = int(os.getenv('COMPRESS_CACHE_BYTES', 32 * 1024 * 1024))
+
+# uncompressed bytes of a stream between flushes, so clients get rows steadily
+STREAM_FLUSH = 64 * 1024
+COMPRESSIBLE = ('application/json', 'application/x-ndjson')
+
+
+def negotiate():
+    """Best encoding the client accepts, or None."""
+    if not ENABLED:
+        return None
+    offers = ['br', 'gzip'] if brotli is not None else ['gzip']
+    return request.accept_encodings.best_match(offers)
+
+
+def etag_variants(tag):
+    return [tag] + [f'{tag}-{enc}' for enc in ('br', 'gzip')]
+
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_LEVEL)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL)
+
+
+def compress_stream(chunks, encoding):
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_LEVEL)
+        process, flush, finish = compressor.process, compressor.flush, compressor.finish
+    else:
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+        process, flush, finish = compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+
+    pending = 0
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        out = process(chunk)
+        pending += len(chunk)
+        if pending >= STREAM_FLUSH:
+            out += flush()
+            pending = 0
+        if out:
+            yield out
+    yield finish()
+
+
+class CompressedCache:
+    """LRU of compressed bodies bounded by their total size."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, tag):
+        with self._lock:
+            item = self._data.get(tag)
+            if item is not None:
+                self._data.move_to_end(tag)
+            return item
+
+    def set(self, tag, body, mimetype):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(tag, None)
+            if old is not None:
+                self.size -= len(old[0])
+            self._data[tag] = (body, mimetype)
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, (evicted, _) = self._data.popitem(last=False)
+                self.size -= len(evicted)
+
+
+compressed_cache = CompressedCache(CACHE_BYTES)
+
+
+def cached_response(tag):
+    """The compressed response stored for the representation `tag`, in the
+    encoding this request negotiates, or None."""
+    encoding = negotiate()
+    if encoding is None:
+        return None
+    item = compressed_cache.get(f'{tag}-{encoding}')
+    if item is None:
+        return None
+
+    body, mimetype = item
+    resp = Response(body, mimetype=mimetype)
+    resp.headers['Content-Encoding'] = encoding
+    resp.set_etag(f'{tag}-{encoding}')
+    resp.vary.update(('Accept', 'Accept-Encoding'))
+    return resp
+
+
+def init_compression(app):
+    if not ENABLED:
+        return
+
+    @app.after_request
+    def compress_response(response):
+        if (
+            request.method == 'HEAD'
+            or response.status_code != 200
+            or response.direct_passthrough
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE and not response.mimetype.startswith('text/')
+        ):
+            return response
+
+        response.vary.add('Accept-Encoding')
+        encoding = negotiate()
+        if encoding is None:
+            return response
+
+        tag, _ = response.get_etag()
+        if response.is_streamed:
+            response.response = compress_stream(response.response, encoding)
+            response.headers.pop('Content-Length', None)
+        else:
+            body = response.get_data()
+            if len(body) < MIN_SIZE:
+                return response
+            response.set_data(compress(body, encoding))
+            if tag:
+                compressed_cache.set(f'{tag}-{encoding}', response.get_data(), response.mimetype)
+
+        response.headers['Content-Encoding'] = encoding
+        if tag:
+            response.set_etag(f'{tag}-{encoding}')
+        return response
@@ -0,0 +1,102 @@
+import hashlib
+from functools import wraps
+from flask import Response, g, make_response, request
+from sqlalchemy import bindparam, text
+from sqlalchemy.exc import DatabaseError
+from database import db
+from utils.compression import cached_response, etag_variants
+from utils.singleflight import flights
+
+
+def bump_versions(*resources):
+    """Invalidate the ETags of `resources`. Runs in the caller's transaction,
+    so it must be called before the write is committed."""
+    db.session.execute(
+        text(
+            "INSERT INTO resource_version (resource, version) VALUES (:r, 1) \
+                ON CONFLICT (resource) DO UPDATE SET version = resource_version.version + 1"
+        ),
+        [{'r': r} for r in resources]
+    )
+
+
+def load_versions(resources):
+    rows = db.session.execute(
+        text("SELECT resource, version FROM resource_version WHERE resource IN :rs")
+            .bindparams(bindparam('rs', expanding=True)),
+        {'rs': list(resources)}
+    ).fetchall()
+    return dict(rows)
+
+
+def compute_etag(resources):
+    versions, _ = flights.do(f'versions:{",".join(resources)}', lambda: load_versions(resources))
+    # views keeping their own caches check them against the same versions
+    g.resource_versions = versions = {r: versions.get(r, 0) for r in resources}
+
+    # the same resource has one representation per query string and Accept header
+    seed = '|'.join(f'{r}={versions[r]}' for r in resources)
+    seed += f'|{request.full_path}|{request.headers.get("Accept", "")}'
+    return hashlib.sha1(seed.encode()).hexdigest()
+
+
+def cache_version():
+    """Version for the read cache entries of the current view: the resource
+    versions its ETag was computed from, or None (don't use the cache) when
+    they couldn't be read or the request must see its own writes (see
+    `utils.replicas`)."""
+    versions = g.get('resource_versions')
+    if versions is None or g.get('read_primary'):
+        return None
+    return ','.join(f'{r}={v}' for r, v in sorted(versions.items()))
+
+
+def freeze(rv):
+    """A view's return value as (body, status, headers) that any request can
+    rebuild, or the response itself when it is streamed."""
+    resp = make_response(rv)
+    if resp.is_streamed:
+        return resp
+    return resp.get_data(), resp.status_code, list(resp.headers)
+
+
+def etag(*resources):
+    """Conditional GET for the decorated view. `resources` are formatted with
+    the view arguments, e.g. 'anime:{anime_id}'. When If-None-Match matches,
+    answers 304 without calling the view, and serves a cached compressed
+    body without calling it either when there is one. Concurrent requests
+    for the same representation share one call of the view."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            try:
+                tag = compute_etag([r.format(**kwargs) for r in resources])
+            except DatabaseError:
+                db.session.rollback()
+                return func(*args, **kwargs)
+
+            # the client may hold any encoding of the representation
+            for variant in etag_variants(tag):
+                if request.if_none_match.contains(variant):
+                    resp = make_response('', 304)
+                    resp.set_etag(variant)
+                    return resp
+
+            cached = cached_response(tag)
+            if cached is not None:
+                return cached
+
+            frozen, leader = flights.do(f'response:{tag}', lambda: freeze(func(*args, **kwargs)))
+            if isinstance(frozen, Response):
+                # a stream is read once, by the request that produced it
+                resp = frozen if leader else make_response(func(*args, **kwargs))
+            else:
+                resp = Response(*frozen)
+                g.coalesced = not leader
+
+            if resp.status_code == 200:
+                resp.set_etag(tag)
+                resp.vary.add('Accept')
+            return resp
+        return wrapper
+    return decorator
@@ -0,0 +1,38 @@
+from flask import request
+
+
+def requested_fields(columns, always=()):
+    """Columns named in ?fields=, in `columns` order, plus the ones in
+    `always`. All of `columns` when the parameter is absent. Raises
+    ValueError for names outside the whitelist or when it names none."""
+    value = request.args.get('fields')
+    if not value:
+        return tuple(columns)
+
+    names = {name.strip() for name in value.split(',') if name.strip()}
+    if not names:
+        raise ValueError('Informe ao menos um campo')
+    unknown = names - set(columns)
+    if unknown:
+        raise ValueError(f"Campos inválidos: {', '.join(sorted(unknown))}")
+
+    names.update(always)
+    return tuple(c for c in columns if c in names)
+
+
+def parse_ids(value, limit):
+    """'3,1,3' -> [3, 1], keeping the request order. Raises ValueError for
+    non integer ids or more than `limit` of them."""
+    ids = []
+    for part in value.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if not part.isdigit():
+            raise ValueError(f'Id inválido: {part}')
+        if int(part) not in ids:
+            ids.append(int(part))
+
+    if not ids or len(ids) > limit:
+        raise ValueError(f'Informe entre 1 e {limit} ids')
+    return ids
@@ -0,0 +1,200 @@
+"""
+Prometheus metrics. Optional: without prometheus_client installed every
+hook here is a no-op and /metrics answers 404.
+
+With several worker processes, point PROMETHEUS_MULTIPROC_DIR to a
+directory shared by them so /metrics aggregates every worker instead of
+reporting only the one that served the scrape. It is created when missing,
+and files left there by processes that are no longer running (a previous
+deploy) are removed when a worker starts. When it can't be used, metrics
+fall back to the worker's own registry. The server should call
+`prometheus_client.multiprocess.mark_process_dead` when a worker exits
+(gunicorn's child_exit hook).
+"""
+
+import glob
+import logging
+import os
+import time
+from functools import wraps
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from utils.serialization import FastJSONProvider, SpecBackend
+from dotenv import load_dotenv
+load_dotenv()
+
+log = logging.getLogger(__name__)
+
+
+def pid_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def prepare_multiproc_dir():
+    """PROMETHEUS_MULTIPROC_DIR, created and cleared of stale files, or None
+    (and unset, so prometheus_client keeps values in memory) when it isn't
+    set or can't be used. Runs before prometheus_client is imported, which
+    is when it decides where values are kept."""
+    path = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+    if not path:
+        return None
+
+    try:
+        os.makedirs(path, exist_ok=True)
+        if not os.access(path, os.W_OK | os.X_OK):
+            raise PermissionError(f'{path} is not writable')
+        # files are named <type>_<pid>.db
+        for file in glob.glob(os.path.join(path, '*.db')):
+            pid = os.path.basename(file)[:-3].rpartition('_')[2]
+            if pid.isdigit() and not pid_running(int(pid)):
+                os.remove(file)
+    except OSError as e:
+        log.error('PROMETHEUS_MULTIPROC_DIR unusable, metrics are per worker: %s', e)
+        del os.environ['PROMETHEUS_MULTIPROC_DIR']
+        return None
+    return path
+
+
+MULTIPROC_DIR = prepare_multiproc_dir()
+
+try:
+    from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest
+    from prometheus_client import REGISTRY, multiprocess
+except ImportError:
+    Counter = None
+
+if Counter is not None:
+    REQUESTS = Counter(
+        'http_requests_total', 'Requests served.', ['route', 'method', 'status']
+    )
+    LATENCY = Histogram(
+        'http_request_duration_seconds', 'Request latency.', ['route', 'method']
+    )
+    PHASES = Histogram(
+        'http_request_phase_seconds', 'Time per request spent in db, validation and serialization.',
+        ['route', 'phase']
+    )
+    COALESCED = Counter(
+        'http_requests_coalesced_total', 'Requests answered with the response of a concurrent identical request.',
+        ['route']
+    )
+    QUERIES = Histogram(
+        'db_query_duration_seconds', 'Statement execution time.', ['route', 'operation'],
+        buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5)
+    )
+
+
+def current_route():
+    if not has_request_context():
+        return 'none'
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+
+def add_phase(phase, seconds):
+    if has_request_context():
+        phases = g.setdefault('phase_seconds', {})
+        phases[phase] = phases.get(phase, 0.0) + seconds
+
+
+class TimedJSONProvider(FastJSONProvider):
+    """Counts the time spent encoding JSON as the serialization phase."""
+
+    def dumps(self, obj, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().dumps(obj, **kwargs)
+        finally:
+            add_phase('serialization', time.perf_counter() - start)
+
+
+class TimedFlaskBackend(SpecBackend):
+    """Counts request and response validation done by `spec.validate` as the
+    validation phase. Response validation is what happens after the view
+    returns, minus the JSON encoding of its return value."""
+
+    def request_validation(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().request_validation(*args, **kwargs)
+        finally:
+            add_phase('validation', time.perf_counter() - start)
+
+    def validate(self, func, *args, **kwargs):
+        @wraps(func)
+        def timed_view(*view_args, **view_kwargs):
+            try:
+                return func(*view_args, **view_kwargs)
+            finally:
+                g.view_finished = time.perf_counter()
+                g.view_serialization = g.get('phase_seconds', {}).get('serialization', 0.0)
+
+        response = super().validate(timed_view, *args, **kwargs)
+        if 'view_finished' in g:
+            serialization = g.get('phase_seconds', {}).get('serialization', 0.0) - g.view_serialization
+            add_phase('validation', time.perf_counter() - g.view_finished - serialization)
+        return response
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+    operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else 'OTHER'
+    QUERIES.labels(current_route(), operation).observe(elapsed)
+    add_phase('db', elapsed)
+
+
+def handle_error(context):
+    # a failed statement never reaches after_cursor_execute
+    starts = context.connection.info.get('query_start') if context.connection is not None else None
+    if starts:
+        starts.pop()
+
+
+def init_metrics(app):
+    if Counter is None:
+        return
+
+    event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+    event.listen(Engine, 'handle_error', handle_error)
+
+    @app.before_request
+    def start_timer():
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        if 'request_start' not in g:
+            return response
+
+        route = current_route()
+        LATENCY.labels(route, request.method).observe(time.perf_counter() - g.request_start)
+        REQUESTS.labels(route, request.method, response.status_code).inc()
+        if g.get('coalesced'):
+            COALESCED.labels(route).inc()
+        for phase, seconds in g.get('phase_seconds', {}).items():
+            PHASES.labels(route, phase).observe(seconds)
+        return response
+
+
+def render_metrics():
+    """(body, content type) for the scrape, or None without prometheus_client."""
+    if Counter is None:
+        return None
+
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry, MULTIPROC_DIR)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,137 @@
+"""
+Admission control and rate limiting, checked before any view runs.
+
+Load shedding: when more than DB_SHED_WAITING requests of this worker are
+already waiting for a connection of the pool the request would use, it is
+answered 503 with a Retry-After right away instead of queueing behind
+them until DB_POOL_TIMEOUT.
+
+Rate limits: token buckets refilled at RATE_LIMIT_*_RATE requests per
+second and holding up to RATE_LIMIT_*_BURST, with separate budgets for
+reads (GET, HEAD) and writes. Every request draws from its client IP's
+bucket, and one carrying a valid access key from that key's bucket too.
+Over either limit the answer is 429 with a Retry-After.
+
+The client IP is the address RATE_LIMIT_PROXY_HOPS proxies back in
+X-Forwarded-For: with the default of 1, the one the reverse proxy in front
+of the API appended. Set it to 0 when clients connect directly, or they
+can pick their own bucket by sending the header. Buckets live in each
+worker process, so with N workers a client gets up to N times the budget.
+
+/health/pool and /metrics are exempt from both.
+"""
+
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from flask import g, request
+from database import db
+from models import JsonResponseMessage
+from utils.authutils import key_index
+from dotenv import load_dotenv
+load_dotenv()
+
+ENABLED = os.getenv('RATE_LIMIT', 'true').lower() in ('1', 'true', 'yes')
+READ_RATE = float(os.getenv('RATE_LIMIT_READ_RATE', 50))
+READ_BURST = float(os.getenv('RATE_LIMIT_READ_BURST', 100))
+WRITE_RATE = float(os.getenv('RATE_LIMIT_WRITE_RATE', 20))
+WRITE_BURST = float(os.getenv('RATE_LIMIT_WRITE_BURST', 100))
+PROXY_HOPS = int(os.getenv('RATE_LIMIT_PROXY_HOPS', 1))
+SHED_WAITING = int(os.getenv('DB_SHED_WAITING', 50))
+SHED_RETRY_AFTER = int(os.getenv('DB_SHED_RETRY_AFTER', 1))
+
+MAX_CLIENTS = 100000
+EXEMPT = ('health.pool_stats', 'health.metrics')
+READ_METHODS = ('GET', 'HEAD')
+
+
+class RateLimiter:
+    """Token buckets keyed by client, the least recently seen dropped past
+    `max_clients` (a dropped client starts again with a full bucket)."""
+
+    def __init__(self, rate, burst, max_clients=MAX_CLIENTS):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, client):
+        """Spend one token of `client`'s bucket. Returns 0 when allowed, or
+        the seconds until a token is available."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.pop(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0.0
+            else:
+                wait = (1 - tokens) / self.rate
+            self._buckets[client] = (tokens, now)
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+def make_limiter(rate, burst):
+    # a rate of 0 turns that budget off
+    return RateLimiter(rate, burst) if rate > 0 else None
+
+
+read_limiter = make_limiter(READ_RATE, READ_BURST)
+write_limiter = make_limiter(WRITE_RATE, WRITE_BURST)
+
+
+def client_ip():
+    # entries further left than the trusted proxies were sent by the client
+    forwarded = request.headers.getlist('X-Forwarded-For')
+    route = [ip.strip() for value in forwarded for ip in value.split(',') if ip.strip()]
+    if PROXY_HOPS and len(route) >= PROXY_HOPS:
+        return route[-PROXY_HOPS]
+    return request.remote_addr
+
+
+def client_ids():
+    """Buckets the request draws from."""
+    ids = [f'ip:{client_ip()}']
+    index = key_index(request.headers)
+    if index is not None:
+        ids.insert(0, f'key:{index}')
+    return ids
+
+
+def pool_waiting():
+    """Requests waiting for a connection of the pool this request uses."""
+    engine = db.engines[g.db_bind] if g.get('db_bind') else db.engine
+    return getattr(engine.pool, 'waiting', 0)
+
+
+def rejected(status_code, message, retry_after):
+    resp = JsonResponseMessage(status_code=status_code, message_type='error', message=message)
+    return resp.dict(), status_code, {'Retry-After': str(max(1, math.ceil(retry_after)))}
+
+
+def init_rate_limits(app):
+    """Registered after `init_replicas`, whose hook picks the bind the
+    shedding looks at, and after `init_metrics`, so rejections are counted."""
+    if not ENABLED:
+        return
+
+    @app.before_request
+    def admit():
+        if request.endpoint in EXEMPT:
+            return None
+
+        if SHED_WAITING and pool_waiting() >= SHED_WAITING:
+            return rejected(503, 'Servidor sobrecarregado, tente novamente', SHED_RETRY_AFTER)
+
+        limiter = read_limiter if request.method in READ_METHODS else write_limiter
+        if limiter is not None:
+            for client in client_ids():
+                wait = limiter.take(client)
+                if wait:
+                    return rejected(429, 'Limite de requisições excedido', wait)
+        return None
@@ -0,0 +1,132 @@
+"""
+Newest episodes across the catalog, for GET /episodes/recent. Episodes are
+ordered by (date, id) descending, read through ix_episode_date_id, and
+paged with a keyset cursor "<date>:<id>" (a bare date starts before that
+day). Episodes without a date are left out.
+
+Each worker keeps the newest RECENT_CACHE_SIZE episodes in memory, tagged
+with the 'episode' and 'anime' resource versions they reflect. A read at
+other versions reloads the window with one indexed query. add_ep moves it
+forward instead: the insert reads the 'episode' version its own bump set,
+and once committed the new row goes into the window if the window was at
+the version right before it, so the window stays exact without a reload.
+"""
+
+import datetime
+import os
+import threading
+from sqlalchemy import text
+from database import db
+from utils.serialization import format_date, row_mapper
+from dotenv import load_dotenv
+load_dotenv()
+
+CACHE_SIZE = int(os.getenv('RECENT_CACHE_SIZE', 200))
+RECENT_COLS = ('id', 'anime_id', 'anime_name', 'number', 'date', 'season', 'url')
+
+
+def parse_cursor(before):
+    """(date, id) from a `before` cursor, raising ValueError when invalid."""
+    date, _, ep_id = before.partition(':')
+    return datetime.date.fromisoformat(date).isoformat(), int(ep_id) if ep_id else 0
+
+
+def make_cursor(row):
+    return f"{row['date']}:{row['id']}"
+
+
+def row_key(row):
+    return row['date'], row['id']
+
+
+def select_recent(limit, before=None):
+    """Up to `limit` episodes older than the `before` cursor, as dicts."""
+    where, params = 'e.date IS NOT NULL', {'limit': limit}
+    if before is not None:
+        # the plain bound lets the planner range scan the index
+        where += ' AND e.date <= :d AND (e.date, e.id) < (:d, :id)'
+        params.update({'d': before[0], 'id': before[1]})
+
+    rows = db.session.execute(
+        text(
+            f'SELECT e.id, e.anime_id, a.name, e.number, e.date, e.season, e.url \
+                FROM episode e JOIN anime a ON a.id = e.anime_id \
+                    WHERE {where} ORDER BY e.date DESC, e.id DESC LIMIT :limit'
+        ),
+        params
+    ).fetchall()
+    return list(map(row_mapper(RECENT_COLS, dates=('date',)), rows))
+
+
+class RecentWindow:
+    def __init__(self, size):
+        self.size = size
+        self.versions = None
+        self.rows = []
+        # the window holds every dated episode, not just the newest ones
+        self.complete = False
+        self._lock = threading.Lock()
+
+    def page(self, versions, limit, before=None):
+        """`limit` + 1 rows from the window, or None when it can't answer."""
+        with self._lock:
+            if versions != self.versions:
+                return None
+            rows = self.rows
+            start = 0
+            if before is not None:
+                while start < len(rows) and row_key(rows[start]) >= before:
+                    start += 1
+            if start + limit + 1 > len(rows) and not self.complete:
+                return None
+            return rows[start:start + limit + 1]
+
+    def load(self, versions):
+        rows = select_recent(self.size)
+        with self._lock:
+            self.versions, self.rows, self.complete = versions, rows, len(rows) < self.size
+
+    def entry(self, ep_id, data):
+        """What `add` needs to put a just inserted episode in the window. Runs
+        in the insert's transaction, after its version bump; None while this
+        worker has no window."""
+        if self.versions is None or not data.get('date'):
+            return None
+        name, version = db.session.execute(
+            text(
+                "SELECT (SELECT name FROM anime WHERE id = :aid), \
+                    (SELECT version FROM resource_version WHERE resource = 'episode')"
+            ),
+            {'aid': data['anime_id']}
+        ).one()
+        row = {
+            'id': ep_id, 'anime_id': data['anime_id'], 'anime_name': name, 'number': data['number'],
+            'date': format_date(data['date']), 'season': data['season'], 'url': data['url'],
+        }
+        return version, row
+
+    def add(self, entry):
+        """Put a committed episode from `entry` in the window."""
+        if entry is None:
+            return
+        version, row = entry
+        with self._lock:
+            if self.versions is None or self.versions[0] != version - 1:
+                return
+            self.versions = (version, self.versions[1])
+            key = row_key(row)
+            if not self.complete and self.rows and key < row_key(self.rows[-1]):
+                return
+            # a load racing the commit may have read the row already
+            if any(r['id'] == row['id'] for r in self.rows):
+                return
+            i = 0
+            while i < len(self.rows) and row_key(self.rows[i]) > key:
+                i += 1
+            self.rows.insert(i, row)
+            if len(self.rows) > self.size:
+                del self.rows[self.size:]
+                self.complete = False
+
+
+recent_window = RecentWindow(CACHE_SIZE)
@@ -0,0 +1,110 @@
+"""
+Read replica routing. With DATABASE_REPLICA_URIS set, GET and HEAD
+requests run on the replicas (round-robin, skipping the ones failing their
+health check) and everything else runs on the primary. A request falls
+back to the primary when no replica is healthy.
+
+After a successful write the client gets a short lived cookie that keeps
+its reads on the primary for DB_REPLICA_STICKY seconds, so it sees its own
+writes despite replication lag. Those reads skip the read cache, which
+other clients fill from the replicas. Other clients may read stale rows for
+up to DB_REPLICA_MAX_LAG seconds.
+"""
+
+import os
+import threading
+import time
+from flask import g, request
+from sqlalchemy import event, text
+from sqlalchemy.exc import DBAPIError
+from database import db
+
+STICKY_COOKIE = 'read_primary'
+STICKY_SECONDS = int(os.getenv('DB_REPLICA_STICKY', 5))
+CHECK_INTERVAL = float(os.getenv('DB_REPLICA_CHECK_INTERVAL', 5))
+MAX_LAG = float(os.getenv('DB_REPLICA_MAX_LAG', 10))
+
+# seconds since the last replayed transaction, 0 when nothing is pending
+PG_LAG = text(
+    'SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+    'ELSE extract(epoch FROM now() - pg_last_xact_replay_timestamp()) END'
+)
+
+
+class ReplicaRouter:
+    def __init__(self, engines):
+        self.engines = engines
+        self.keys = list(engines)
+        self.healthy = {key: True for key in self.keys}
+        self.checked_at = {key: 0.0 for key in self.keys}
+        self._next = 0
+        self._lock = threading.Lock()
+        self._checking = threading.Lock()
+
+    def pick(self):
+        """Bind key of the next healthy replica, or None for the primary."""
+        with self._lock:
+            start = self._next
+            self._next = (self._next + 1) % len(self.keys)
+
+        for i in range(len(self.keys)):
+            key = self.keys[(start + i) % len(self.keys)]
+            if self.is_healthy(key):
+                return key
+        return None
+
+    def is_healthy(self, key):
+        if time.monotonic() - self.checked_at[key] > CHECK_INTERVAL and self._checking.acquire(blocking=False):
+            # one request checks while the others keep the last result
+            try:
+                self.check(key)
+            finally:
+                self._checking.release()
+        return self.healthy[key]
+
+    def check(self, key):
+        engine = self.engines[key]
+        try:
+            with engine.connect() as conn:
+                if engine.dialect.name == 'postgresql':
+                    lag = conn.execute(PG_LAG).scalar()
+                    self.healthy[key] = lag is None or lag <= MAX_LAG
+                else:
+                    conn.execute(text('SELECT 1'))
+                    self.healthy[key] = True
+        except DBAPIError:
+            self.healthy[key] = False
+        self.checked_at[key] = time.monotonic()
+
+    def mark_down(self, key):
+        self.healthy[key] = False
+        self.checked_at[key] = time.monotonic()
+
+
+def init_replicas(app):
+    with app.app_context():
+        engines = {key: engine for key, engine in db.engines.items() if key is not None}
+    if not engines:
+        return
+
+    router = ReplicaRouter(engines)
+    for key, engine in engines.items():
+        def handle_error(context, key=key):
+            if context.is_disconnect:
+                router.mark_down(key)
+        event.listen(engine, 'handle_error', handle_error)
+
+    @app.before_request
+    def route_reads():
+        if request.method not in ('GET', 'HEAD'):
+            return
+        if request.cookies.get(STICKY_COOKIE):
+            g.read_primary = True
+        else:
+            g.db_bind = router.pick()
+
+    @app.after_request
+    def stick_to_primary(response):
+        if request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400:
+            response.set_cookie(STICKY_COOKIE, '1', max_age=STICKY_SECONDS, httponly=True)
+        return response
@@ -0,0 +1,47 @@
+from sqlalchemy import bindparam, text
+from database import db
+
+
+def is_postgres():
+    return db.session.get_bind().dialect.name == 'postgresql'
+
+
+def sync_search_index(*anime_ids):
+    """Refresh the index entries of `anime_ids` from the anime table, inside
+    the caller's transaction. Postgres maintains its generated column itself."""
+    if not anime_ids or is_postgres():
+        return
+
+    ids = {'ids': list(anime_ids)}
+    db.session.execute(
+        text('DELETE FROM anime_fts WHERE rowid IN :ids').bindparams(bindparam('ids', expanding=True)), ids
+    )
+    db.session.execute(
+        text(
+            'INSERT INTO anime_fts (rowid, name, categories, sinopse) \
+                SELECT id, name, categories, sinopse FROM anime WHERE id IN :ids'
+        ).bindparams(bindparam('ids', expanding=True)),
+        ids
+    )
+
+
+def fts5_query(q):
+    # every term quoted, so user input can't break the MATCH syntax
+    return ' '.join('"' + term.replace('"', '""') + '"' for term in q.split())
+
+
+def search_animes(columns, q, limit, offset):
+    """Best ranked animes matching `q`, as rows of `columns`."""
+    cols = ', '.join(f'a.{c}' for c in columns)
+    params = {'limit': limit, 'offset': offset}
+
+    if is_postgres():
+        sql = f"SELECT {cols} FROM anime a, websearch_to_tsquery('portuguese', :q) query \
+            WHERE a.search @@ query ORDER BY ts_rank(a.search, query) DESC, a.id LIMIT :limit OFFSET :offset"
+        params['q'] = q
+    else:
+        sql = f"SELECT {cols} FROM anime_fts JOIN anime a ON a.id = anime_fts.rowid \
+            WHERE anime_fts MATCH :q ORDER BY bm25(anime_fts, 10.0, 5.0, 1.0), a.id LIMIT :limit OFFSET :offset"
+        params['q'] = fts5_query(q)
+
+    return db.session.execute(text(sql), params).fetchall()
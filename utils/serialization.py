@@ -0,0 +1,93 @@
+"""
+Response fast path. Rows read from the database are trusted: the GET views
+turn them into dicts with a mapper built once per column list and hand
+them straight to the JSON provider, without going through the pydantic
+models. The models still document the responses in the spec, and
+`spec.validate` checks responses against them when VALIDATE_RESPONSES is
+set or the app runs in debug mode.
+"""
+
+import datetime
+import os
+from functools import lru_cache
+from flask import current_app
+from flask.json.provider import DefaultJSONProvider
+from flask_pydantic_spec.flask_backend import FlaskBackend
+from dotenv import load_dotenv
+load_dotenv()
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+VALIDATE_RESPONSES = os.getenv('VALIDATE_RESPONSES', 'false').lower() in ('1', 'true', 'yes')
+
+
+def format_date(value):
+    # same format the Episode model gives dates
+    return value.strftime('%Y-%m-%d') if isinstance(value, datetime.date) else value
+
+
+def format_timestamp(value):
+    """ISO 8601 in UTC, from a datetime or from SQLite's 'YYYY-MM-DD HH:MM:SS'."""
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(datetime.timezone.utc)
+        return value.strftime('%Y-%m-%dT%H:%M:%SZ')
+    return value.replace(' ', 'T')[:19] + 'Z' if value else value
+
+
+@lru_cache(maxsize=None)
+def row_mapper(columns, dates=()):
+    """Function turning a row of `columns` into a JSON ready dict, with the
+    `dates` columns formatted as YYYY-MM-DD."""
+    columns = tuple(columns)
+    date_indexes = [i for i, c in enumerate(columns) if c in dates]
+    if not date_indexes:
+        return lambda row: dict(zip(columns, row))
+
+    def to_dict(row):
+        values = list(row)
+        for i in date_indexes:
+            values[i] = format_date(values[i])
+        return dict(zip(columns, values))
+    return to_dict
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Encodes with orjson when it is installed, keeping the output of the
+    default provider (sorted keys, non ASCII kept as is)."""
+
+    ensure_ascii = False
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, datetime.date):
+            return format_date(o)
+        return DefaultJSONProvider.default(o)
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None:
+            return super().dumps(obj, **kwargs)
+
+        # `response` always passes one of these: orjson output is already
+        # compact, and indents by 2 when asked to (debug mode)
+        extra = dict(kwargs)
+        extra.pop('separators', None)
+        option = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS
+        if extra.get('indent') == 2:
+            del extra['indent']
+            option |= orjson.OPT_INDENT_2
+        if extra:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=option).decode()
+
+
+class SpecBackend(FlaskBackend):
+    """Request validation always, response validation only as a debug aid."""
+
+    def validate(self, func, query, body, headers, cookies, resp, *args, **kwargs):
+        if not (VALIDATE_RESPONSES or current_app.debug):
+            resp = None
+        return super().validate(func, query, body, headers, cookies, resp, *args, **kwargs)
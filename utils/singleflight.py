@@ -0,0 +1,71 @@
+"""
+Request coalescing for the read path. Concurrent callers asking for the
+same key while a call for it is in flight wait for that call and share its
+result (or its exception) instead of running their own. Nothing is kept
+once the call returns: a caller arriving afterwards starts a new one, so a
+shared result is never older than a query that was already running when
+the caller came in.
+
+Calls are also keyed by the request's database bind (`g.db_bind`), so a
+request pinned to the primary never gets a result read from a replica.
+
+Coalescing is per process. Under gevent the threading primitives are
+monkey patched, so waiting callers are parked greenlets.
+"""
+
+import os
+import threading
+from flask import g, has_request_context
+from dotenv import load_dotenv
+load_dotenv()
+
+ENABLED = os.getenv('SINGLE_FLIGHT', 'true').lower() in ('1', 'true', 'yes')
+
+
+class _Call:
+    __slots__ = ('done', 'value', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        """Run `fn` for `key`, or wait for the call already running for it.
+        Returns `(value, leader)`, `leader` being False when the value came
+        from another caller's call."""
+        if not ENABLED:
+            return fn(), True
+
+        key = (g.get('db_bind') if has_request_context() else None, key)
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value, False
+
+        try:
+            call.value = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.value, True
+
+
+flights = SingleFlight()
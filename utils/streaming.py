@@ -0,0 +1,46 @@
+from functools import wraps
+from flask import Response, current_app, request, stream_with_context
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+STREAM_BATCH = 500
+
+
+def wants_ndjson():
+    if request.args.get('format') == 'ndjson':
+        return True
+    return request.accept_mimetypes.best_match(['application/json', NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+
+
+def ndjson_response(rows):
+    """Stream an iterable of dicts as one JSON document per line."""
+    def generate():
+        for row in rows:
+            yield current_app.json.dumps(row) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
+
+
+def read_rows():
+    """Rows of a bulk request body, sent as a JSON array or as NDJSON."""
+    if request.mimetype == NDJSON_MIMETYPE:
+        lines = request.get_data(as_text=True).splitlines()
+        return [current_app.json.loads(line) for line in lines if line.strip()]
+
+    rows = request.get_json(silent=True)
+    if not isinstance(rows, list):
+        raise ValueError('O corpo deve ser uma lista JSON ou NDJSON')
+    return rows
+
+
+def ndjson(streamer):
+    """Serve the route with `streamer` instead of the decorated view when
+    the client asks for NDJSON. Goes between the route and `spec.validate`,
+    since the streamed body can't go through response validation."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if wants_ndjson():
+                return streamer(*args, **kwargs)
+            return func(*args, **kwargs)
+        return wrapper
+    return decorator
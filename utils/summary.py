@@ -0,0 +1,32 @@
+from sqlalchemy import text
+from database import db
+
+
+def add_to_season_summary(anime_id, season, count):
+    """Add `count` (negative to remove) episodes to a season's summary row.
+    Runs in the caller's transaction."""
+    db.session.execute(
+        text(
+            "INSERT INTO season_summary (anime_id, season, episodes) VALUES (:aid, :s, :n) \
+                ON CONFLICT (anime_id, season) DO UPDATE SET episodes = season_summary.episodes + excluded.episodes"
+        ),
+        {'aid': anime_id, 's': season, 'n': count}
+    )
+    if count < 0:
+        db.session.execute(
+            text("DELETE FROM season_summary WHERE anime_id = :aid AND season = :s AND episodes <= 0"),
+            {'aid': anime_id, 's': season}
+        )
+
+
+def rebuild_season_summary(anime_id=None):
+    """Recount the summary from the episode table, for one anime or all of them."""
+    where = 'WHERE anime_id = :aid' if anime_id is not None else ''
+    db.session.execute(text(f"DELETE FROM season_summary {where}"), {'aid': anime_id})
+    db.session.execute(
+        text(
+            f"INSERT INTO season_summary (anime_id, season, episodes) \
+                SELECT anime_id, season, count(*) FROM episode {where} GROUP BY anime_id, season"
+        ),
+        {'aid': anime_id}
+    )
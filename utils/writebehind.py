@@ -0,0 +1,284 @@
+"""
+Write-behind mode for the scraper writes (WRITE_BEHIND=true). The handlers
+validate the request, store it as a job in a SQLite file and answer 202
+with the job id, pollable at GET /jobs/<id>. A background flusher applies
+the queued jobs in batches of up to WRITE_BATCH_ROWS, one transaction (and
+one commit) per batch, waking every WRITE_BATCH_MS or as soon as a full
+batch is waiting.
+
+The queue file outlives the worker: jobs left queued, or claimed by a
+worker that died mid-flush, are picked up by the next flusher, which starts
+with the app. A job can thus be delivered twice (its batch committed just
+before a crash, or outlived its lease), so applying it first records its id
+in the applied_job table of the database, in the same transaction, and a
+job already recorded there is skipped. Only one flush runs at a time
+across processes, so jobs apply in the order they were accepted.
+"""
+
+import json
+import os
+import queue
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from sqlalchemy import text
+from database import db
+from models import JobAccepted
+from utils.search import is_postgres
+from dotenv import load_dotenv
+load_dotenv()
+
+ENABLED = os.getenv('WRITE_BEHIND', 'false').lower() in ('1', 'true', 'yes')
+QUEUE_PATH = os.getenv('WRITE_QUEUE_PATH', os.path.join(tempfile.gettempdir(), 'animesonline-writes.sqlite3'))
+BATCH_ROWS = int(os.getenv('WRITE_BATCH_ROWS', 200))
+BATCH_MS = int(os.getenv('WRITE_BATCH_MS', 50))
+# a claimed batch not finished after this many seconds is given to another flusher
+LEASE_SECONDS = 60
+RETENTION_SECONDS = 24 * 3600
+# applied_job rows are pruned at most this often, per process
+PRUNE_EVERY = 3600
+
+# kind -> (apply(payload), after_commit(payload, applied))
+JOBS = {}
+
+
+def register_job(kind, apply, after_commit=None):
+    """`apply` does the database work of a job in the current transaction
+    without committing; `after_commit` runs once it is committed, with what
+    `apply` returned."""
+    JOBS[kind] = (apply, after_commit)
+
+
+class JobQueue:
+    def __init__(self, path):
+        self.path = path
+        self._pid = None
+        self._idle = None
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS job ('
+            'seq INTEGER PRIMARY KEY AUTOINCREMENT, id TEXT NOT NULL UNIQUE, kind TEXT NOT NULL, '
+            'payload TEXT NOT NULL, status TEXT NOT NULL, error TEXT, '
+            'created_at REAL NOT NULL, claimed_at REAL, finished_at REAL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS ix_job_status ON job (status, seq)')
+        return conn
+
+    @contextmanager
+    def conn(self):
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._idle = queue.LifoQueue()
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self.connect()
+        try:
+            yield conn
+        finally:
+            self._idle.put(conn)
+
+    def put(self, kind, payload):
+        job_id = uuid.uuid4().hex
+        with self.conn() as conn:
+            conn.execute(
+                "INSERT INTO job (id, kind, payload, status, created_at) VALUES (?, ?, ?, 'queued', ?)",
+                (job_id, kind, json.dumps(payload), time.time())
+            )
+        return job_id
+
+    def get(self, job_id):
+        with self.conn() as conn:
+            row = conn.execute(
+                'SELECT id, kind, status, error, created_at, finished_at FROM job WHERE id = ?', (job_id,)
+            ).fetchone()
+        return dict(zip(('id', 'kind', 'status', 'error', 'created_at', 'finished_at'), row)) if row else None
+
+    def queued(self):
+        with self.conn() as conn:
+            return conn.execute("SELECT count(*) FROM job WHERE status = 'queued'").fetchone()[0]
+
+    def claim(self, limit):
+        """Mark the next `limit` queued jobs as running and return them, or
+        nothing while another flusher holds an unexpired batch."""
+        now = time.time()
+        with self.conn() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute(
+                    "UPDATE job SET status = 'queued', claimed_at = NULL WHERE status = 'running' AND claimed_at < ?",
+                    (now - LEASE_SECONDS,)
+                )
+                if conn.execute("SELECT 1 FROM job WHERE status = 'running' LIMIT 1").fetchone():
+                    conn.execute('COMMIT')
+                    return []
+                rows = conn.execute(
+                    "SELECT seq, id, kind, payload FROM job WHERE status = 'queued' ORDER BY seq LIMIT ?", (limit,)
+                ).fetchall()
+                conn.executemany(
+                    "UPDATE job SET status = 'running', claimed_at = ? WHERE seq = ?", [(now, seq) for seq, *_ in rows]
+                )
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        return [(job_id, kind, json.loads(payload)) for _, job_id, kind, payload in rows]
+
+    def finish(self, results):
+        """`results` maps job ids to None (done) or an error message."""
+        now = time.time()
+        with self.conn() as conn:
+            conn.executemany(
+                'UPDATE job SET status = ?, error = ?, finished_at = ? WHERE id = ?',
+                [('failed' if error else 'done', error, now, job_id) for job_id, error in results.items()]
+            )
+            conn.execute(
+                "DELETE FROM job WHERE status IN ('done', 'failed') AND finished_at < ?", (now - RETENTION_SECONDS,)
+            )
+
+
+job_queue = JobQueue(QUEUE_PATH)
+
+
+def apply_job(job_id, kind, payload):
+    """Apply a job in the current transaction, unless it was applied before.
+    Returns (applied now, what `apply` returned)."""
+    # waits for a flusher still applying the same job, then sees its row
+    first = db.session.execute(
+        text(
+            "INSERT INTO applied_job (id, applied_at) VALUES (:id, CURRENT_TIMESTAMP) \
+                ON CONFLICT (id) DO NOTHING RETURNING id"
+        ),
+        {'id': job_id}
+    ).scalar()
+    if first is None:
+        return False, None
+    return True, JOBS[kind][0](payload)
+
+
+def apply_batch(jobs):
+    """Apply `jobs` in one transaction. When the batch fails, each job is
+    retried in a transaction of its own so one bad row fails alone."""
+    applied = {}
+    try:
+        for job_id, kind, payload in jobs:
+            applied[job_id] = apply_job(job_id, kind, payload)
+        db.session.commit()
+        results = {job_id: None for job_id, _, _ in jobs}
+    except Exception:
+        db.session.rollback()
+        results = {}
+        for job_id, kind, payload in jobs:
+            try:
+                applied[job_id] = apply_job(job_id, kind, payload)
+                db.session.commit()
+                results[job_id] = None
+            except Exception as e:
+                db.session.rollback()
+                results[job_id] = str(e)
+
+    for job_id, kind, payload in jobs:
+        after_commit = JOBS[kind][1]
+        if results[job_id] is None and applied[job_id][0] and after_commit:
+            after_commit(payload, applied[job_id][1])
+    return results
+
+
+def prune_applied():
+    """Forget applied jobs finished long ago, which can't be replayed anymore."""
+    if is_postgres():
+        cutoff, params = "now() - make_interval(secs => :secs)", {'secs': RETENTION_SECONDS}
+    else:
+        cutoff, params = "datetime('now', :secs)", {'secs': f'-{RETENTION_SECONDS} seconds'}
+    db.session.execute(text(f"DELETE FROM applied_job WHERE applied_at < {cutoff}"), params)
+    db.session.commit()
+
+
+def flush(app):
+    """Apply every queued job, batch by batch. Returns how many ran."""
+    ran = 0
+    with app.app_context():
+        while True:
+            jobs = job_queue.claim(BATCH_ROWS)
+            if not jobs:
+                return ran
+            job_queue.finish(apply_batch(jobs))
+            ran += len(jobs)
+
+
+class Flusher:
+    def __init__(self, app):
+        self.app = app
+        self.wakeup = threading.Event()
+        self.pending = 0
+        self.pruned_at = 0.0
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def ensure_running(self):
+        # one thread per process, started again after a fork
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                threading.Thread(target=self.run, name='write-behind', daemon=True).start()
+
+    def notify(self):
+        self.pending += 1
+        if self.pending >= BATCH_ROWS:
+            self.wakeup.set()
+
+    def run(self):
+        while True:
+            self.wakeup.wait(BATCH_MS / 1000)
+            self.wakeup.clear()
+            self.pending = 0
+            try:
+                flush(self.app)
+                if time.monotonic() - self.pruned_at > PRUNE_EVERY:
+                    with self.app.app_context():
+                        prune_applied()
+                    self.pruned_at = time.monotonic()
+            except Exception as e:
+                self.app.logger.exception('write-behind flush failed: %s', e)
+                time.sleep(1)
+
+
+flusher = None
+
+
+def enqueue(kind, payload):
+    """Queue a job, returning its id."""
+    job_id = job_queue.put(kind, payload)
+    flusher.notify()
+    return job_id
+
+
+def accepted(job_id):
+    """202 response for a queued job."""
+    resp = JobAccepted(status_code=202, message_type='info', message='Escrita enfileirada', job_id=job_id)
+    return resp.dict(), 202, {'Location': f'/jobs/{job_id}'}
+
+
+def init_write_behind(app):
+    global flusher
+    if not ENABLED:
+        return
+    flusher = Flusher(app)
+    # jobs left from the last run don't wait for the first request; the
+    # flask CLI (migrations, `jobs flush`) gets no background flusher
+    if not os.getenv('FLASK_RUN_FROM_CLI'):
+        flusher.ensure_running()
+
+    # started again in a worker forked after the app was loaded
+    @app.before_request
+    def start_flusher():
+        flusher.ensure_running()
@@ -2,37 +2,129 @@ from flask import request
 from flask.json import jsonify
 from flask_pydantic_spec import Response
 from pydantic import ValidationError
-from models import Animes, Anime, JsonResponseMessage
+from models import Animes, Anime, AnimeFull, AnimeQuery, AnimeSearch, FieldsQuery, SearchQuery, JobAccepted, JsonResponseMessage, UpsertResult
 from flask import Blueprint
 from api_spec import spec
 from database import db
-from sqlalchemy import text
+from sqlalchemy import bindparam, text
 from utils.authutils import validate_auth
+from views.ep import EP_COLS
+from utils.cache import read_cache
+from utils.changes import record_changes
+from utils.categories import category_filter, parse_categories, sync_categories, sync_categories_many
+from utils.etag import etag, bump_versions, cache_version
+from utils.fields import parse_ids, requested_fields
+from utils.search import search_animes, sync_search_index
+from utils.serialization import row_mapper
+from utils import writebehind
+from utils.streaming import ndjson, ndjson_response, read_rows, STREAM_BATCH
 from pprint import pprint
 from sqlalchemy.exc import DatabaseError, DataError, IntegrityError
 
 anime_bp = Blueprint('anime', __name__)
 spec.register(anime_bp)
 ANIME_COLS = ('id', 'name', 'year', 'sinopse', 'categories', 'rate', 'url')
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+MAX_BULK_ROWS = 5000
+UPSERT_BATCH = 500
+MAX_BATCH_IDS = 100
+
+
+def select_animes(after, category=None, limit=None, columns=ANIME_COLS):
+    """Statement and params for a page of the catalog in id order, optionally
+    restricted to the animes having every category in `category`."""
+    where, params = ['id > :after'], {'after': after or 0}
+    names = parse_categories(category)
+    if names:
+        sql, category_params = category_filter(names)
+        where.append(sql)
+        params.update(category_params)
+
+    sql = f"SELECT {', '.join(columns)} FROM anime WHERE {' AND '.join(where)} ORDER BY id"
+    if limit is not None:
+        sql += ' LIMIT :limit'
+        params['limit'] = limit
+
+    stmt = text(sql)
+    if names:
+        stmt = stmt.bindparams(bindparam('category_names', expanding=True))
+    return stmt, params
+
+
+def get_animes_by_id(ids, columns):
+    """Multi-get for ?ids=, in request order, reporting the ids not found."""
+    try:
+        query_result = db.session.execute(
+            text(f"SELECT {', '.join(columns)} FROM anime WHERE id IN :ids")
+                .bindparams(bindparam('ids', expanding=True)),
+            {'ids': ids}
+        ).fetchall()
+
+        to_dict = row_mapper(columns)
+        found = {row[0]: to_dict(row) for row in query_result}
+        resp = {
+            'animes': [found[i] for i in ids if i in found],
+            'missing': [i for i in ids if i not in found],
+        }
+        return jsonify(resp), 200
+
+    except DatabaseError as e:
+        return JsonResponseMessage(status_code=400, message_type='error', message=str(e)).dict(), 400
+
+
+def stream_animes():
+    after = request.args.get('after', 0, type=int)
+    try:
+        columns = requested_fields(ANIME_COLS, always=('id',))
+    except ValueError as e:
+        return JsonResponseMessage(status_code=422, message_type='error', message=str(e)).dict(), 422
+
+    try:
+        stmt, params = select_animes(after, request.args.get('category'), columns=columns)
+        result = db.session.execute(
+            stmt,
+            params,
+            execution_options={'stream_results': True, 'yield_per': STREAM_BATCH}
+        )
+    except DatabaseError as e:
+        return JsonResponseMessage(status_code=400, message_type='error', message=str(e)).dict(), 400
+
+    return ndjson_response(map(row_mapper(columns), result))
+
 
 @anime_bp.route('/anime', methods=['GET'])
-@spec.validate(resp=Response(HTTP_200=Animes, 
+@etag('anime')
+@ndjson(stream_animes)
+@spec.validate(query=AnimeQuery, resp=Response(HTTP_200=Animes, 
                              HTTP_404=JsonResponseMessage, 
                              HTTP_400=JsonResponseMessage, 
                              HTTP_422=JsonResponseMessage, 
                              HTTP_500=JsonResponseMessage))
 def list_animes():
+    query = request.context.query  # type: ignore
+    limit = min(query.limit or PAGE_SIZE, MAX_PAGE_SIZE)
     try:
-        query_result = db.session.execute(text(
-            f"SELECT {', '.join(ANIME_COLS)} FROM anime"
-        )).fetchall()
+        columns = requested_fields(ANIME_COLS, always=('id',))
+        ids = parse_ids(query.ids, MAX_BATCH_IDS) if query.ids is not None else None
+    except ValueError as e:
+        return JsonResponseMessage(status_code=422, message_type='error', message=str(e)).dict(), 422
+
+    if ids is not None:
+        return get_animes_by_id(ids, columns)
+
+    try:
+        # keyset pagination: one extra row tells whether there is a next page
+        stmt, params = select_animes(query.after, query.category, limit + 1, columns)
+        query_result = db.session.execute(stmt, params).fetchall()
         
         if not query_result:
             msg = 'Não há animes para exibir'
             return JsonResponseMessage(status_code=404, message_type='error', message=msg).dict(), 404
         
-        resp = [dict(zip(ANIME_COLS, row)) for row in query_result]
-        return jsonify(Animes(animes=resp).dict()), 200
+        next_cursor = query_result[limit - 1][0] if len(query_result) > limit else None
+        resp = list(map(row_mapper(columns), query_result[:limit]))
+        return jsonify({'animes': resp, 'next_cursor': next_cursor}), 200
     
     except DataError as e:
         return JsonResponseMessage(status_code=422, message_type='error', message=str(e)).dict(), 422
@@ -44,8 +136,29 @@ def list_animes():
         return JsonResponseMessage(status_code=500, message_type='error', message=str(e)).dict(), 500
 
 
+def insert_anime(context):
+    """INSERT of one anime with its search entry, categories and change log.
+    Runs in the caller's transaction, returns the new id."""
+    anime_id = db.session.execute(
+        text(
+            "INSERT INTO anime (name, year, sinopse, categories, rate, url, updated_at) \
+                VALUES (:name, :year, :sinopse, :categories, :rate, :url, CURRENT_TIMESTAMP) RETURNING id"),
+        {c: context.get(c) for c in ANIME_COLS[1:]}
+    ).scalar()
+
+    sync_search_index(anime_id)
+    sync_categories(anime_id, context.get('categories'))
+    record_changes('anime', 'upsert', [(anime_id, anime_id)])
+    bump_versions('anime')
+    return anime_id
+
+
+writebehind.register_job('add_anime', insert_anime)
+
+
 @anime_bp.route('/anime', methods=['POST'])
 @spec.validate(body=Anime, resp=Response(HTTP_201=JsonResponseMessage, 
+                                         HTTP_202=JobAccepted, 
                                          HTTP_404=JsonResponseMessage, 
                                          HTTP_400=JsonResponseMessage, 
                                          HTTP_403=JsonResponseMessage, 
@@ -62,28 +175,11 @@ def add_anime():
         msg = 'Dados inválidos'
         return JsonResponseMessage(status_code=404, message_type='error', message=msg).dict(), 404
     
-    try:
-        name = context.get('name')
-        year = context.get('year')
-        sinopse = context.get('sinopse')
-        categories = context.get('categories')
-        rate = context.get('rate')
-        url = context.get('url')
-
-        db.session.execute(
-            text(
-                "INSERT INTO anime (name, year, sinopse, categories, rate, url) \
-                    VALUES (:name, :year, :sinopse, :categories, :rate, :url)"),
-            {
-                'name': name, 
-                'year':year, 
-                'sinopse': sinopse, 
-                'categories':categories, 
-                'rate':rate, 
-                'url':url
-            }
-        )
+    if writebehind.ENABLED:
+        return writebehind.accepted(writebehind.enqueue('add_anime', context))
 
+    try:
+        insert_anime(context)
         db.session.commit()
         return JsonResponseMessage(
             status_code=201, 
@@ -116,26 +212,168 @@ def add_anime():
         ).dict(), 500
 
 
+@anime_bp.route('/anime/bulk', methods=['POST'])
+@spec.validate(resp=Response(HTTP_200=UpsertResult, 
+                             HTTP_400=JsonResponseMessage, 
+                             HTTP_403=JsonResponseMessage, 
+                             HTTP_422=UpsertResult, 
+                             HTTP_500=JsonResponseMessage))
+def upsert_animes():
+    if not validate_auth(request.headers):
+        msg = 'Acesso não autorizado.'
+        return JsonResponseMessage(status_code=403, message_type='error', message=msg).dict(), 403
+
+    try:
+        rows = read_rows()
+    except ValueError as e:
+        return JsonResponseMessage(status_code=400, message_type='error', message=str(e)).dict(), 400
+
+    if not rows or len(rows) > MAX_BULK_ROWS:
+        msg = f'Envie entre 1 e {MAX_BULK_ROWS} animes'
+        return JsonResponseMessage(status_code=400, message_type='error', message=msg).dict(), 400
+
+    # keyed on url, the last occurrence of a repeated url wins
+    animes, errors = {}, []
+    for index, row in enumerate(rows):
+        try:
+            if not isinstance(row, dict):
+                raise ValueError('Anime deve ser um objeto JSON')
+            anime = Anime(**row).dict(exclude={'id'})
+        except (ValidationError, ValueError, TypeError) as e:
+            errors.append({'index': index, 'message': str(e)})
+            continue
+
+        if not anime['url']:
+            errors.append({'index': index, 'message': 'Anime sem url'})
+            continue
+        animes[anime['url']] = anime
+
+    if not animes:
+        return UpsertResult(status_code=422, inserted=0, updated=0, unchanged=0, errors=errors).dict(), 422
+
+    columns = ANIME_COLS[1:]
+    assignments = ', '.join(f'{c} = excluded.{c}' for c in (*columns, 'updated_at') if c != 'url')
+    changed = ' OR '.join(f'anime.{c} IS DISTINCT FROM excluded.{c}' for c in columns if c != 'url')
+    inserted, updated, categories = [], [], {}
+
+    try:
+        batch = list(animes.values())
+        for start in range(0, len(batch), UPSERT_BATCH):
+            chunk = batch[start:start + UPSERT_BATCH]
+            urls = [a['url'] for a in chunk]
+            existing = set(db.session.execute(
+                text("SELECT url FROM anime WHERE url IN :urls").bindparams(bindparam('urls', expanding=True)),
+                {'urls': urls}
+            ).scalars())
+
+            placeholders = ', '.join(
+                '(' + ', '.join(f':{c}_{i}' for c in columns) + ', CURRENT_TIMESTAMP)' for i in range(len(chunk))
+            )
+            values = {f'{c}_{i}': anime[c] for i, anime in enumerate(chunk) for c in columns}
+
+            # rows that are already up to date are filtered by the WHERE and not returned
+            result = db.session.execute(
+                text(
+                    f"INSERT INTO anime ({', '.join(columns)}, updated_at) VALUES {placeholders} \
+                        ON CONFLICT (url) DO UPDATE SET {assignments} WHERE {changed} \
+                            RETURNING id, url"
+                ),
+                values
+            ).fetchall()
+            for anime_id, url in result:
+                (updated if url in existing else inserted).append(anime_id)
+                categories[anime_id] = animes[url]['categories']
+
+        if inserted or updated:
+            sync_categories_many(categories)
+            sync_search_index(*inserted, *updated)
+            record_changes('anime', 'upsert', [(anime_id, anime_id) for anime_id in (*inserted, *updated)])
+            bump_versions('anime', *(f'anime:{anime_id}' for anime_id in updated))
+        db.session.commit()
+        read_cache.invalidate(*(f'anime:{anime_id}' for anime_id in updated))
+
+        return UpsertResult(
+            status_code=200,
+            inserted=len(inserted),
+            updated=len(updated),
+            unchanged=len(animes) - len(inserted) - len(updated),
+            errors=errors
+        ).dict(), 200
+
+    except DatabaseError as e:
+        db.session.rollback()
+        return JsonResponseMessage(status_code=400, message_type='error', message=str(e)).dict(), 400
+
+    except Exception as e:
+        db.session.rollback()
+        return JsonResponseMessage(status_code=500, message_type='error', message=str(e)).dict(), 500
+
+
+@anime_bp.route('/anime/search', methods=['GET'])
+@etag('anime')
+@spec.validate(query=SearchQuery, resp=Response(HTTP_200=AnimeSearch, 
+                                                HTTP_404=JsonResponseMessage, 
+                                                HTTP_400=JsonResponseMessage, 
+                                                HTTP_500=JsonResponseMessage))
+def search_anime():
+    query = request.context.query  # type: ignore
+    limit = min(query.limit or PAGE_SIZE, MAX_PAGE_SIZE)
+    offset = query.offset or 0
+    try:
+        columns = requested_fields(ANIME_COLS, always=('id',))
+    except ValueError as e:
+        return JsonResponseMessage(status_code=422, message_type='error', message=str(e)).dict(), 422
+
+    try:
+        query_result = search_animes(columns, query.q, limit + 1, offset)
+
+        if not query_result:
+            msg = 'Nenhum anime encontrado'
+            return JsonResponseMessage(status_code=404, message_type='info', message=msg).dict(), 404
+
+        next_offset = offset + limit if len(query_result) > limit else None
+        resp = list(map(row_mapper(columns), query_result[:limit]))
+        return jsonify({'animes': resp, 'next_offset': next_offset}), 200
+
+    except DatabaseError as e:
+        db.session.rollback()
+        return JsonResponseMessage(status_code=400, message_type='error', message=str(e)).dict(), 400
+
+    except Exception as e:
+        db.session.rollback()
+        return JsonResponseMessage(status_code=500, message_type='error', message=str(e)).dict(), 500
+
+
 @anime_bp.route('/anime/<int:anime_id>', methods=['GET'])
-@spec.validate(resp=Response(HTTP_200=Anime, HTTP_404=JsonResponseMessage, HTTP_422=JsonResponseMessage))
+@etag('anime:{anime_id}')
+@spec.validate(query=FieldsQuery, resp=Response(HTTP_200=Anime, HTTP_404=JsonResponseMessage, HTTP_422=JsonResponseMessage))
 def get_anime(anime_id: int):
     try:
+        columns = requested_fields(ANIME_COLS)
+    except ValueError as e:
+        return JsonResponseMessage(status_code=422, message_type='error', message=str(e)).dict(), 422
+
+    # the cache holds whole rows, the projection is applied on the way out
+    def load():
         query_result = db.session.execute(
             text(
                 f"SELECT {', '.join(ANIME_COLS)} FROM anime WHERE id = :id LIMIT 1"
             ), 
             {'id': anime_id}
         ).fetchone()
+        return row_mapper(ANIME_COLS)(query_result) if query_result else None
 
-        if not query_result:
+    try:
+        resp = read_cache.fetch(f'anime:{anime_id}', load, cache_version())
+
+        if not resp:
             return JsonResponseMessage(
                 status_code=404, 
                 message_type='info', 
                 message='Anime não encontrado'
             ).dict(), 404
         
-        resp = dict(zip(ANIME_COLS, query_result))
-        return jsonify(Anime(**resp).dict()), 200
+        return jsonify({c: resp[c] for c in columns}), 200
 
     except (DataError, IndexError) as e:
         return JsonResponseMessage(
@@ -152,6 +390,53 @@ def get_anime(anime_id: int):
         ).dict(), 404
 
 
+@anime_bp.route('/anime/<int:anime_id>/full', methods=['GET'])
+@etag('anime:{anime_id}', 'episode:{anime_id}')
+@spec.validate(resp=Response(HTTP_200=AnimeFull, 
+                             HTTP_404=JsonResponseMessage, 
+                             HTTP_400=JsonResponseMessage, 
+                             HTTP_500=JsonResponseMessage))
+def get_anime_full(anime_id: int):
+    try:
+        anime = db.session.execute(
+            text(f"SELECT {', '.join(ANIME_COLS)} FROM anime WHERE id = :id"),
+            {'id': anime_id}
+        ).fetchone()
+
+        if not anime:
+            return JsonResponseMessage(
+                status_code=404, 
+                message_type='info', 
+                message='Anime não encontrado'
+            ).dict(), 404
+
+        episodes = db.session.execute(
+            text(
+                f"SELECT {', '.join(EP_COLS)} FROM episode WHERE anime_id = :id \
+                    ORDER BY season, date, number"
+            ),
+            {'id': anime_id}
+        ).fetchall()
+
+        seasons = {}
+        for ep in map(row_mapper(EP_COLS, dates=('date',)), episodes):
+            seasons.setdefault(ep['season'], []).append(ep)
+
+        resp = {
+            'anime': row_mapper(ANIME_COLS)(anime),
+            'seasons': [{'season': season, 'episodes': eps} for season, eps in seasons.items()],
+        }
+        return jsonify(resp), 200
+
+    except DatabaseError as e:
+        db.session.rollback()
+        return JsonResponseMessage(status_code=400, message_type='error', message=str(e)).dict(), 400
+
+    except Exception as e:
+        db.session.rollback()
+        return JsonResponseMessage(status_code=500, message_type='error', message=str(e)).dict(), 500
+
+
 @anime_bp.route('/anime/<int:anime_id>', methods=['PUT'])
 @spec.validate(body=Anime, resp=Response(HTTP_404=JsonResponseMessage, 
                                          HTTP_200=JsonResponseMessage, 
@@ -176,14 +461,29 @@ def modify_anime(anime_id: int):
 
 
     mask = ', '.join(f'{c} = :{c}' for c in columns)
-    sql_query = f"UPDATE anime SET {mask} WHERE id = :id"
+    # skip the write entirely when nothing differs from the stored row
+    changed = ' OR '.join(f'{c} IS DISTINCT FROM :{c}' for c in columns if c != 'id')
+    sql_query = f"UPDATE anime SET {mask}, updated_at = CURRENT_TIMESTAMP WHERE id = :id AND ({changed})"
 
     try:
-        db.session.execute(
+        result = db.session.execute(
             text(sql_query),
             values
         )
+        if not result.rowcount:
+            db.session.rollback()
+            return JsonResponseMessage(
+                status_code=200, 
+                message_type='info', 
+                message='Nenhuma alteração no anime'
+            ).dict(), 200
+
+        sync_search_index(anime_id)
+        sync_categories(anime_id, data.get('categories'))
+        record_changes('anime', 'upsert', [(anime_id, anime_id)])
+        bump_versions('anime', f'anime:{anime_id}')
         db.session.commit()
+        read_cache.invalidate(f'anime:{anime_id}')
         return JsonResponseMessage(
             status_code=200, 
             message_type='success', 
@@ -226,12 +526,27 @@ def delete_anime(anime_id: int):
         return JsonResponseMessage(status_code=403, message_type='error', message=msg).dict(), 403
     
     try:
-        db.session.execute(
-            text("DELETE FROM anime WHERE id = :id"),
+        # links go first, so the category counts are decremented
+        sync_categories(anime_id, None)
+        # explicitly rather than through the FK cascade, which older schemas
+        # lack, so every episode gets its own tombstone in the change log
+        deleted_eps = db.session.execute(
+            text("DELETE FROM episode WHERE anime_id = :id RETURNING id"),
             {'id': anime_id}
-        )
+        ).scalars().all()
+        deleted = db.session.execute(
+            text("DELETE FROM anime WHERE id = :id RETURNING id"),
+            {'id': anime_id}
+        ).fetchall()
 
+        db.session.execute(text("DELETE FROM season_summary WHERE anime_id = :id"), {'id': anime_id})
+        sync_search_index(anime_id)
+        record_changes('episode', 'delete', [(ep_id, anime_id) for ep_id in deleted_eps])
+        record_changes('anime', 'delete', [(anime_id, anime_id) for _ in deleted])
+        bump_versions('anime', 'episode', f'anime:{anime_id}', f'episode:{anime_id}')
         db.session.commit()
+        read_cache.invalidate(f'anime:{anime_id}', f'seasons:{anime_id}')
+        read_cache.invalidate_prefix(f'eps:{anime_id}:', f'ep:{anime_id}:')
         return JsonResponseMessage(
             status_code=204, 
             message_type='success', 
@@ -0,0 +1,49 @@
+from flask import Blueprint
+from flask.json import jsonify
+from sqlalchemy.exc import DatabaseError
+from flask_pydantic_spec import Response
+from models import Categories, JsonResponseMessage
+from api_spec import spec
+from sqlalchemy import text
+from database import db
+from utils.etag import etag
+
+category_bp = Blueprint('category', __name__)
+spec.register(category_bp)
+
+
+@category_bp.route('/categories', methods=['GET'])
+@etag('anime')
+@spec.validate(resp=Response(HTTP_200=Categories, 
+                             HTTP_404=JsonResponseMessage, 
+                             HTTP_400=JsonResponseMessage, 
+                             HTTP_500=JsonResponseMessage))
+def list_categories():
+    try:
+        query_result = db.session.execute(
+            text('SELECT name, animes FROM category WHERE animes > 0 ORDER BY animes DESC, name')
+        ).fetchall()
+
+        if not query_result:
+            return JsonResponseMessage(
+                status_code=404, 
+                message_type='info', 
+                message='Não há categorias para exibir'
+            ).dict(), 404
+
+        resp = [{'name': name, 'animes': animes} for name, animes in query_result]
+        return jsonify({'categories': resp}), 200
+
+    except DatabaseError as e:
+        return JsonResponseMessage(
+            status_code=400, 
+            message_type='error', 
+            message=str(e)
+        ).dict(), 400
+
+    except Exception as e:
+        return JsonResponseMessage(
+            status_code=500, 
+            message_type='error', 
+            message=str(e)
+        ).dict(), 500
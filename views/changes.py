@@ -0,0 +1,90 @@
+import click
+from flask import Blueprint, request
+from flask.json import jsonify
+from flask_pydantic_spec import Response
+from sqlalchemy import text
+from sqlalchemy.exc import DatabaseError
+from api_spec import spec
+from database import db
+from models import Changes, ChangesQuery, JsonResponseMessage
+from utils.search import is_postgres
+from utils.serialization import format_timestamp, row_mapper
+from views.anime import ANIME_COLS
+from views.ep import EP_COLS
+
+changes_bp = Blueprint('changes', __name__)
+spec.register(changes_bp)
+PAGE_SIZE = 500
+MAX_PAGE_SIZE = 5000
+
+CHANGES_SQL = "SELECT c.id, c.resource, c.resource_id, c.anime_id, c.op, c.changed_at, {anime_cols}, {ep_cols} \
+    FROM change_log c \
+    LEFT JOIN anime a ON c.resource = 'anime' AND c.op = 'upsert' AND a.id = c.resource_id \
+    LEFT JOIN episode e ON c.resource = 'episode' AND c.op = 'upsert' AND e.id = c.resource_id \
+    WHERE c.id > :since ORDER BY c.id LIMIT :limit"
+
+
+@changes_bp.cli.command('prune')
+@click.option('--days', default=30, show_default=True, help='Keep the entries of the last DAYS days.')
+def prune_changes(days):
+    """Delete old change log entries. Mirrors behind them must resync."""
+    if is_postgres():
+        cutoff, params = "now() - make_interval(days => :days)", {'days': days}
+    else:
+        cutoff, params = "datetime('now', :days)", {'days': f'-{days} days'}
+    # the newest entry always stays, list_changes tells expired cursors by it
+    count = db.session.execute(
+        text(f"DELETE FROM change_log WHERE changed_at < {cutoff} AND id < (SELECT max(id) FROM change_log)"),
+        params
+    ).rowcount
+    db.session.commit()
+    click.echo(f'{count} entries deleted')
+
+
+@changes_bp.route('/changes', methods=['GET'])
+@spec.validate(query=ChangesQuery, resp=Response(HTTP_200=Changes,
+                                                 HTTP_400=JsonResponseMessage,
+                                                 HTTP_410=JsonResponseMessage))
+def list_changes():
+    """Anime and episode writes after the cursor `since`, oldest first. An
+    upsert carries the current row, or null when it was deleted since. A
+    deleted anime is preceded by a delete of each of its episodes."""
+    query = request.context.query  # type: ignore
+    since = query.since or 0
+    limit = min(query.limit or PAGE_SIZE, MAX_PAGE_SIZE)
+
+    try:
+        oldest = db.session.execute(text('SELECT min(id) FROM change_log')).scalar()
+        if since and oldest is not None and since < oldest - 1:
+            msg = 'Cursor expirado, sincronize o catálogo novamente'
+            return JsonResponseMessage(status_code=410, message_type='error', message=msg).dict(), 410
+
+        sql = CHANGES_SQL.format(
+            anime_cols=', '.join(f'a.{c}' for c in ANIME_COLS),
+            ep_cols=', '.join(f'e.{c}' for c in EP_COLS),
+        )
+        rows = db.session.execute(text(sql), {'since': since, 'limit': limit + 1}).fetchall()
+    except DatabaseError as e:
+        db.session.rollback()
+        return JsonResponseMessage(status_code=400, message_type='error', message=str(e)).dict(), 400
+
+    anime_row, ep_row = row_mapper(ANIME_COLS), row_mapper(EP_COLS, dates=('date',))
+    changes = []
+    for row in rows[:limit]:
+        cursor, resource, resource_id, anime_id, op, changed_at = row[:6]
+        data = row[6:6 + len(ANIME_COLS)] if resource == 'anime' else row[6 + len(ANIME_COLS):]
+        changes.append({
+            'cursor': cursor,
+            'resource': resource,
+            'id': resource_id,
+            'anime_id': anime_id,
+            'op': op,
+            'changed_at': format_timestamp(changed_at),
+            'data': (anime_row if resource == 'anime' else ep_row)(data) if data[0] is not None else None,
+        })
+
+    return jsonify({
+        'changes': changes,
+        'next_since': changes[-1]['cursor'] if changes else since,
+        'has_more': len(rows) > limit,
+    }), 200
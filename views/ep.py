@@ -1,42 +1,103 @@
-from flask import request
+import datetime
+from flask import g, request
 from flask.json import jsonify
 from sqlalchemy.exc import DatabaseError, DataError
-from sqlalchemy import text
+from sqlalchemy import bindparam, text
 from flask_pydantic_spec import Response
-from models import JsonResponseMessage, Episode, SeasonEpisodes
+from models import JsonResponseMessage, Episode, Episodes, EpisodeIdsQuery, SeasonEpisodes, BulkResult, FieldsQuery, JobAccepted
+from models import RecentEpisodes, RecentQuery
 from flask import Blueprint
 from api_spec import spec
 from utils.authutils import validate_auth
+from utils.cache import read_cache
+from utils.changes import record_changes
+from utils.etag import etag, bump_versions, cache_version
+from utils.fields import parse_ids, requested_fields
+from utils.recent import make_cursor, parse_cursor, recent_window, select_recent
+from utils.serialization import row_mapper
+from utils.singleflight import flights
+from utils.summary import add_to_season_summary, rebuild_season_summary
+from utils import writebehind
+from utils.streaming import ndjson, ndjson_response, read_rows, STREAM_BATCH
 from pydantic import ValidationError
 from database import db
 
 ep_bp = Blueprint('ep', __name__)
 spec.register(ep_bp)
-EP_COLS = ['id', 'anime_id', 'number', 'date', 'season', 'url']
+EP_COLS = ('id', 'anime_id', 'number', 'date', 'season', 'url')
+MAX_BULK_ROWS = 5000
+MAX_URL_LENGTH = 512
+INSERT_BATCH = 500
+MAX_BATCH_IDS = 100
+RECENT_PAGE_SIZE = 20
+MAX_RECENT_PAGE_SIZE = 100
+
+
+def invalidate_ep_cache(anime_id, season, number):
+    read_cache.invalidate(
+        f'seasons:{anime_id}',
+        f'eps:{anime_id}:{season}',
+        f'ep:{anime_id}:{season}:{number}'
+    )
+
+
+def stream_eps(anime_id: int, season_num: int):
+    try:
+        columns = requested_fields(EP_COLS)
+    except ValueError as e:
+        return JsonResponseMessage(status_code=422, message_type='error', message=str(e)).dict(), 422
+
+    try:
+        result = db.session.execute(
+            text(
+                f'SELECT {", ".join(columns)} \
+                    FROM episode WHERE anime_id = :anime_id AND season = :s \
+                        ORDER BY date, number'
+            ),
+            {'anime_id': anime_id, 's': season_num},
+            execution_options={'stream_results': True, 'yield_per': STREAM_BATCH}
+        )
+    except DatabaseError as e:
+        db.session.rollback()
+        return JsonResponseMessage(status_code=404, message_type='error', message=str(e)).dict(), 404
+
+    return ndjson_response(map(row_mapper(columns, dates=('date',)), result))
+
 
 @ep_bp.route('/anime/<int:anime_id>/season/<int:season_num>/episode', methods=['GET'])
-@spec.validate(resp=Response(HTTP_200=SeasonEpisodes, 
+@etag('episode:{anime_id}')
+@ndjson(stream_eps)
+@spec.validate(query=FieldsQuery, resp=Response(HTTP_200=SeasonEpisodes, 
                              HTTP_404=JsonResponseMessage, 
                              HTTP_422=JsonResponseMessage, 
                              HTTP_500=JsonResponseMessage))
 def list_eps(anime_id: int, season_num: str):
     try:
+        columns = requested_fields(EP_COLS)
+    except ValueError as e:
+        return JsonResponseMessage(status_code=422, message_type='error', message=str(e)).dict(), 422
+
+    # the cache holds whole rows, the projection is applied on the way out
+    def load():
         query_result = db.session.execute(
             text(
                 f'SELECT {", ".join(EP_COLS)} \
                     FROM episode WHERE anime_id = :anime_id AND season = :s \
                         ORDER BY date, number'
             ),
-            {'anime_id': anime_id, 's': str(season_num)}
+            {'anime_id': anime_id, 's': season_num}
         ).fetchall()
-        query_result = list(map(lambda x: (x[0], x[1], x[2], x[3], int(x[4]), x[5]), query_result))
+        return list(map(row_mapper(EP_COLS, dates=('date',)), query_result)) or None
+
+    try:
+        resp = read_cache.fetch(f'eps:{anime_id}:{season_num}', load, cache_version())
 
-        if not query_result:
+        if not resp:
             msg = 'Não há episódios para exibir'
             return JsonResponseMessage(status_code=404, message_type='error', message=msg).dict(), 404
 
-        resp = [Episode(**dict(zip(EP_COLS, row))) for row in query_result]
-        return jsonify(SeasonEpisodes(season=season_num, episodes=resp).dict()), 200
+        resp = [{c: ep[c] for c in columns} for ep in resp]
+        return jsonify({'season': season_num, 'episodes': resp}), 200
 
     except DataError as e:
         db.session.rollback()
@@ -51,8 +112,67 @@ def list_eps(anime_id: int, season_num: str):
         return JsonResponseMessage(status_code=500, message_type='error', message=str(e)).dict(), 500
 
 
+def insert_ep(data):
+    """INSERT of one episode with its season summary and change log. Runs in
+    the caller's transaction, returns the entry for the recent window."""
+    sql = f'INSERT INTO episode ({", ".join(EP_COLS[1:])}, updated_at) \
+        VALUES (:aid, :n, :d, :s, :u, CURRENT_TIMESTAMP) RETURNING id'
+    val = {'aid': data['anime_id'], 'n': data['number'], 'd': data['date'], 's': data['season'], 'u': data['url']}
+
+    ep_id = db.session.execute(
+        text(sql), val
+    ).scalar()
+
+    record_changes('episode', 'upsert', [(ep_id, data['anime_id'])])
+    add_to_season_summary(data['anime_id'], data['season'], 1)
+    bump_versions('episode', f'episode:{data["anime_id"]}')
+    return recent_window.entry(ep_id, data)
+
+
+def after_insert_ep(data, entry=None):
+    invalidate_ep_cache(data['anime_id'], data['season'], data['number'])
+    recent_window.add(entry)
+
+
+def update_ep(job):
+    """UPDATE of the episode at job['anime_id'], ['season'], ['number'] with
+    job['data'], which may move it elsewhere. Runs in the caller's transaction."""
+    anime_id, season_num, ep_num, data = job['anime_id'], job['season'], job['number'], job['data']
+    columns = tuple(data.keys())
+    values = data.copy()
+    values.update({'aid': anime_id, 's': season_num, 'n': ep_num})
+
+    mask = ', '.join(f'{c} = :{c}' for c in columns)
+    sql_query = f"UPDATE episode SET {mask}, updated_at = CURRENT_TIMESTAMP \
+        WHERE anime_id = :aid AND season = :s AND number = :n RETURNING id, anime_id"
+
+    changed = db.session.execute(
+        text(sql_query),
+        values
+    ).fetchall()
+    record_changes('episode', 'upsert', changed)
+    # the body may move the episode to another anime/season/number
+    new_anime_id = data.get('anime_id') or anime_id
+    for aid in {anime_id, new_anime_id}:
+        rebuild_season_summary(aid)
+    bump_versions(*{'episode', f'episode:{anime_id}', f'episode:{new_anime_id}'})
+
+
+def after_update_ep(job, _=None):
+    data = job['data']
+    invalidate_ep_cache(job['anime_id'], job['season'], job['number'])
+    invalidate_ep_cache(
+        data.get('anime_id') or job['anime_id'], data.get('season') or job['season'], data.get('number') or job['number']
+    )
+
+
+writebehind.register_job('add_ep', insert_ep, after_insert_ep)
+writebehind.register_job('modify_ep', update_ep, after_update_ep)
+
+
 @ep_bp.route('/anime/<int:anime_id>/season/<int:season_num>/episode', methods=['POST'])
 @spec.validate(body=Episode, resp=Response(HTTP_201=JsonResponseMessage, 
+                                           HTTP_202=JobAccepted, 
                                            HTTP_400=JsonResponseMessage, 
                                            HTTP_403=JsonResponseMessage, 
                                            HTTP_422=JsonResponseMessage, 
@@ -65,26 +185,20 @@ def add_ep(anime_id: int, season_num: int):
     
     data = request.context.body.dict()  # type: ignore
     print(data)
-    anime_id = data.get('anime_id')
-    number = data.get('number')
     season = data.get('season')
-    date = data.get('date')
-    url = data.get('url')
 
     has_none = list(filter(lambda x: x is None, data.values()))
     if not data or has_none or season != season_num:
         msg = 'Dados inválidos'
         return JsonResponseMessage(status_code=400, message_type='error', message=msg).dict(), 400
     
-    try:
-        sql = f'INSERT INTO episode ({", ".join(EP_COLS[1:])}) VALUES (:aid, :n, :d, :s, :u)'
-        val = {'aid': anime_id, 'n': str(number), 'd': date, 's': str(season), 'u': url}
-
-        db.session.execute(
-            text(sql), val
-        )
+    if writebehind.ENABLED:
+        return writebehind.accepted(writebehind.enqueue('add_ep', data))
 
+    try:
+        entry = insert_ep(data)
         db.session.commit()
+        after_insert_ep(data, entry)
         return JsonResponseMessage(
             status_code=201, 
             message_type='success', 
@@ -104,6 +218,111 @@ def add_ep(anime_id: int, season_num: int):
         return JsonResponseMessage(status_code=500, message_type='error', message=msg).dict(), 500
 
 
+@ep_bp.route('/anime/<int:anime_id>/season/<int:season_num>/episode/bulk', methods=['POST'])
+@spec.validate(resp=Response(HTTP_201=BulkResult, 
+                             HTTP_400=JsonResponseMessage, 
+                             HTTP_403=JsonResponseMessage, 
+                             HTTP_404=JsonResponseMessage, 
+                             HTTP_422=BulkResult, 
+                             HTTP_500=JsonResponseMessage))
+def add_bulk_eps(anime_id: int, season_num: int):
+    if not validate_auth(request.headers):
+        msg = 'Acesso não autorizado.'
+        return JsonResponseMessage(status_code=403, message_type='error', message=msg).dict(), 403
+
+    try:
+        rows = read_rows()
+    except ValueError as e:
+        return JsonResponseMessage(status_code=400, message_type='error', message=str(e)).dict(), 400
+
+    if not rows or len(rows) > MAX_BULK_ROWS:
+        msg = f'Envie entre 1 e {MAX_BULK_ROWS} episódios'
+        return JsonResponseMessage(status_code=400, message_type='error', message=msg).dict(), 400
+
+    anime_found = db.session.execute(
+        text('SELECT 1 FROM anime WHERE id = :id'), {'id': anime_id}
+    ).scalar()
+    if not anime_found:
+        msg = 'Anime não encontrado'
+        return JsonResponseMessage(status_code=404, message_type='error', message=msg).dict(), 404
+
+    # rows are checked for everything the database would reject, so one
+    # bad row is reported by its index instead of failing the whole batch
+    values, errors = {}, []
+    for index, row in enumerate(rows):
+        try:
+            if not isinstance(row, dict):
+                raise ValueError('Episódio deve ser um objeto JSON')
+            ep = Episode(**{'anime_id': anime_id, 'season': season_num, **row})
+        except (ValidationError, ValueError, TypeError) as e:
+            errors.append({'index': index, 'message': str(e)})
+            continue
+
+        if ep.anime_id != anime_id or ep.season != season_num or None in (ep.number, ep.date, ep.url):
+            errors.append({'index': index, 'message': 'Dados inválidos'})
+            continue
+
+        try:
+            date = datetime.date.fromisoformat(ep.date).isoformat()
+        except ValueError:
+            errors.append({'index': index, 'message': f'Data inválida: {ep.date}'})
+            continue
+
+        if len(ep.url) > MAX_URL_LENGTH:
+            errors.append({'index': index, 'message': f'Url maior que {MAX_URL_LENGTH} caracteres'})
+            continue
+
+        if ep.number in values:
+            errors.append({'index': index, 'message': f'Episódio {ep.number} repetido no lote'})
+            continue
+
+        values[ep.number] = {'aid': anime_id, 'n': ep.number, 'd': date, 's': season_num, 'u': ep.url, 'index': index}
+
+    if values:
+        existing = db.session.execute(
+            text('SELECT number FROM episode WHERE anime_id = :aid AND season = :s AND number IN :ns')
+                .bindparams(bindparam('ns', expanding=True)),
+            {'aid': anime_id, 's': season_num, 'ns': list(values)}
+        ).scalars().all()
+        for number in existing:
+            errors.append({'index': values.pop(number)['index'], 'message': f'Episódio {number} já existe'})
+        errors.sort(key=lambda error: error['index'])
+    values = [{k: v for k, v in row.items() if k != 'index'} for row in values.values()]
+
+    if not values:
+        return BulkResult(status_code=422, inserted=0, errors=errors).dict(), 422
+
+    try:
+        # multi-row VALUES, so the new ids come back for the change log
+        ep_ids = []
+        for start in range(0, len(values), INSERT_BATCH):
+            chunk = values[start:start + INSERT_BATCH]
+            placeholders = ', '.join(
+                f'(:aid_{i}, :n_{i}, :d_{i}, :s_{i}, :u_{i}, CURRENT_TIMESTAMP)' for i in range(len(chunk))
+            )
+            params = {f'{k}_{i}': v for i, row in enumerate(chunk) for k, v in row.items()}
+            ep_ids += db.session.execute(
+                text(f'INSERT INTO episode ({", ".join(EP_COLS[1:])}, updated_at) VALUES {placeholders} RETURNING id'),
+                params
+            ).scalars().all()
+
+        record_changes('episode', 'upsert', [(ep_id, anime_id) for ep_id in ep_ids])
+        add_to_season_summary(anime_id, season_num, len(values))
+        bump_versions('episode', f'episode:{anime_id}')
+        db.session.commit()
+        read_cache.invalidate(f'seasons:{anime_id}', f'eps:{anime_id}:{season_num}')
+        read_cache.invalidate_prefix(f'ep:{anime_id}:{season_num}:')
+        return BulkResult(status_code=201, inserted=len(values), errors=errors).dict(), 201
+
+    except DatabaseError as e:
+        db.session.rollback()
+        return JsonResponseMessage(status_code=400, message_type='error', message=str(e)).dict(), 400
+
+    except Exception as e:
+        db.session.rollback()
+        return JsonResponseMessage(status_code=500, message_type='error', message=str(e)).dict(), 500
+
+
 @ep_bp.route('/anime/<int:anime_id>/season/<int:season_num>/episode/<int:ep_num>', methods=['DELETE'])
 @spec.validate(resp=Response(HTTP_204=JsonResponseMessage, 
                              HTTP_404=JsonResponseMessage, 
@@ -116,11 +335,16 @@ def delete_ep(anime_id: int, season_num: int, ep_num: int):
         return JsonResponseMessage(status_code=403, message_type='error', message=msg).dict(), 403
     
     try:
-        db.session.execute(
-            text('DELETE FROM episode WHERE anime_id = :aid AND season = :s AND number = :n'),
-            {'aid': anime_id, 's': str(season_num), 'n': str(ep_num)}
-        )
+        deleted = db.session.execute(
+            text('DELETE FROM episode WHERE anime_id = :aid AND season = :s AND number = :n RETURNING id'),
+            {'aid': anime_id, 's': season_num, 'n': ep_num}
+        ).scalars().all()
+        if deleted:
+            add_to_season_summary(anime_id, season_num, -len(deleted))
+            record_changes('episode', 'delete', [(ep_id, anime_id) for ep_id in deleted])
+        bump_versions('episode', f'episode:{anime_id}')
         db.session.commit()
+        invalidate_ep_cache(anime_id, season_num, ep_num)
         return JsonResponseMessage(
             status_code=204, 
             message_type='success', 
@@ -154,6 +378,7 @@ def delete_ep(anime_id: int, season_num: int, ep_num: int):
 
 @ep_bp.route('/anime/<int:anime_id>/season/<int:season_num>/episode/<int:ep_num>', methods=['PUT'])
 @spec.validate(body=Episode, resp=Response(HTTP_200=JsonResponseMessage, 
+                                           HTTP_202=JobAccepted, 
                                            HTTP_404=JsonResponseMessage, 
                                            HTTP_403=JsonResponseMessage, 
                                            HTTP_422=JsonResponseMessage, 
@@ -164,20 +389,15 @@ def modify_ep(anime_id: int, season_num: int, ep_num: int):
         return JsonResponseMessage(status_code=403, message_type='error', message=msg).dict(), 403
     
     data = request.context.body.dict()  # type: ignore
-    
-    columns = tuple(data.keys())
-    values = data.copy()
-    values.update({'aid': anime_id, 's': str(season_num), 'n': str(ep_num)})
- 
-    mask = ', '.join(f'{c} = :{c}' for c in columns)
-    sql_query = f"UPDATE episode SET {mask} WHERE anime_id = :aid AND season = :s AND number = :n"
+    job = {'anime_id': anime_id, 'season': season_num, 'number': ep_num, 'data': data}
+
+    if writebehind.ENABLED:
+        return writebehind.accepted(writebehind.enqueue('modify_ep', job))
 
     try:
-        db.session.execute(
-            text(sql_query),
-            values
-        )
+        update_ep(job)
         db.session.commit()
+        after_update_ep(job)
         return JsonResponseMessage(
             status_code=200, 
             message_type='success', 
@@ -210,27 +430,39 @@ def modify_ep(anime_id: int, season_num: int, ep_num: int):
 
 
 @ep_bp.route('/anime/<int:anime_id>/season/<int:season_num>/episode/<int:ep_num>', methods=['GET'])
-@spec.validate(resp=Response(HTTP_200=Episode, 
+@etag('episode:{anime_id}')
+@spec.validate(query=FieldsQuery, resp=Response(HTTP_200=Episode, 
                              HTTP_404=JsonResponseMessage, 
                              HTTP_422=JsonResponseMessage, 
                              HTTP_500=JsonResponseMessage, 
                              HTTP_400=JsonResponseMessage))
 def get_ep(anime_id: int, season_num: str, ep_num: int):
     try:
+        columns = requested_fields(EP_COLS)
+    except ValueError as e:
+        return JsonResponseMessage(status_code=422, message_type='error', message=str(e)).dict(), 422
+
+    def load():
         query_result = db.session.execute(
-            text('SELECT * FROM episode WHERE anime_id = :aid AND season = :s and number = :n'),
-            {'aid': anime_id, 's': str(season_num), 'n': str(ep_num)}
+            text(
+                f'SELECT {", ".join(EP_COLS)} FROM episode \
+                    WHERE anime_id = :aid AND season = :s and number = :n'
+            ),
+            {'aid': anime_id, 's': season_num, 'n': ep_num}
         ).fetchone()
+        return row_mapper(EP_COLS, dates=('date',))(query_result) if query_result else None
+
+    try:
+        resp = read_cache.fetch(f'ep:{anime_id}:{season_num}:{ep_num}', load, cache_version())
         
-        if not query_result:
+        if not resp:
             return JsonResponseMessage(
             status_code=404, 
             message_type='info', 
             message='Não há episódios para exibir'
         ).dict(), 404
         
-        resp = Episode(**dict(zip(EP_COLS, query_result)))
-        return jsonify(resp.dict()), 200
+        return jsonify({c: resp[c] for c in columns}), 200
 
     except DataError as e:
         db.session.rollback()
@@ -251,3 +483,80 @@ def get_ep(anime_id: int, season_num: str, ep_num: int):
             message_type='error', 
             message=str(e)
         ).dict(), 500
+
+
+@ep_bp.route('/episodes', methods=['GET'])
+@etag('episode')
+@spec.validate(query=EpisodeIdsQuery, resp=Response(HTTP_200=Episodes, 
+                                                    HTTP_400=JsonResponseMessage, 
+                                                    HTTP_422=JsonResponseMessage, 
+                                                    HTTP_500=JsonResponseMessage))
+def get_eps_by_id():
+    try:
+        ids = parse_ids(request.context.query.ids, MAX_BATCH_IDS)  # type: ignore
+        columns = requested_fields(EP_COLS, always=('id',))
+    except ValueError as e:
+        return JsonResponseMessage(status_code=422, message_type='error', message=str(e)).dict(), 422
+
+    try:
+        query_result = db.session.execute(
+            text(f'SELECT {", ".join(columns)} FROM episode WHERE id IN :ids')
+                .bindparams(bindparam('ids', expanding=True)),
+            {'ids': ids}
+        ).fetchall()
+
+        to_dict = row_mapper(columns, dates=('date',))
+        found = {row[0]: to_dict(row) for row in query_result}
+        resp = {
+            'episodes': [found[i] for i in ids if i in found],
+            'missing': [i for i in ids if i not in found],
+        }
+        return jsonify(resp), 200
+
+    except DatabaseError as e:
+        db.session.rollback()
+        return JsonResponseMessage(status_code=400, message_type='error', message=str(e)).dict(), 400
+
+    except Exception as e:
+        db.session.rollback()
+        return JsonResponseMessage(status_code=500, message_type='error', message=str(e)).dict(), 500
+
+
+@ep_bp.route('/episodes/recent', methods=['GET'])
+@etag('episode', 'anime')
+@spec.validate(query=RecentQuery, resp=Response(HTTP_200=RecentEpisodes, 
+                                                HTTP_400=JsonResponseMessage, 
+                                                HTTP_422=JsonResponseMessage, 
+                                                HTTP_500=JsonResponseMessage))
+def list_recent_eps():
+    query = request.context.query  # type: ignore
+    limit = min(query.limit or RECENT_PAGE_SIZE, MAX_RECENT_PAGE_SIZE)
+    try:
+        before = parse_cursor(query.before) if query.before else None
+    except ValueError:
+        msg = 'Cursor inválido, use AAAA-MM-DD ou o next_before da página anterior'
+        return JsonResponseMessage(status_code=422, message_type='error', message=msg).dict(), 422
+
+    try:
+        # versions read by the etag check, None when it couldn't read them
+        versions = g.get('resource_versions')
+        rows = None
+        if versions is not None:
+            versions = (versions.get('episode', 0), versions.get('anime', 0))
+            rows = recent_window.page(versions, limit, before)
+            if rows is None and before is None:
+                flights.do(f'recent:{versions}', lambda: recent_window.load(versions))
+                rows = recent_window.page(versions, limit)
+        if rows is None:
+            rows = select_recent(limit + 1, before)
+
+        next_before = make_cursor(rows[limit - 1]) if len(rows) > limit else None
+        return jsonify({'episodes': rows[:limit], 'next_before': next_before}), 200
+
+    except DatabaseError as e:
+        db.session.rollback()
+        return JsonResponseMessage(status_code=400, message_type='error', message=str(e)).dict(), 400
+
+    except Exception as e:
+        db.session.rollback()
+        return JsonResponseMessage(status_code=500, message_type='error', message=str(e)).dict(), 500
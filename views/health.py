@@ -0,0 +1,43 @@
+from flask import Blueprint, Response as FlaskResponse
+from flask.json import jsonify
+from flask_pydantic_spec import Response
+from models import PoolStats, JsonResponseMessage
+from api_spec import spec
+from database import db
+from utils.metrics import render_metrics
+
+health_bp = Blueprint('health', __name__)
+spec.register(health_bp)
+
+
+@health_bp.route('/health/pool', methods=['GET'])
+@spec.validate(resp=Response(HTTP_200=PoolStats, HTTP_404=JsonResponseMessage))
+def pool_stats():
+    """Connection pool usage of this worker process."""
+    pool = db.engine.pool
+    if hasattr(pool, 'stats'):
+        return jsonify(PoolStats(**pool.stats()).dict()), 200
+
+    if not hasattr(pool, 'checkedout'):
+        msg = 'Pool sem estatísticas'
+        return JsonResponseMessage(status_code=404, message_type='info', message=msg).dict(), 404
+
+    stats = {
+        'size': pool.size(),
+        'checked_out': pool.checkedout(),
+        'checked_in': pool.checkedin(),
+        'overflow': pool.overflow(),
+    }
+    return jsonify(PoolStats(**stats).dict(exclude_unset=True)), 200
+
+
+@health_bp.route('/metrics', methods=['GET'])
+@spec.validate(resp=Response(HTTP_404=JsonResponseMessage))
+def metrics():
+    rendered = render_metrics()
+    if rendered is None:
+        msg = 'Métricas indisponíveis, instale prometheus_client'
+        return JsonResponseMessage(status_code=404, message_type='info', message=msg).dict(), 404
+
+    body, content_type = rendered
+    return FlaskResponse(body, content_type=content_type)
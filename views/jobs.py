@@ -0,0 +1,37 @@
+import datetime
+import click
+from flask import Blueprint, current_app
+from flask.json import jsonify
+from flask_pydantic_spec import Response
+from models import Job, JsonResponseMessage
+from api_spec import spec
+from utils.writebehind import flush, job_queue
+
+jobs_bp = Blueprint('jobs', __name__)
+spec.register(jobs_bp)
+
+
+def format_time(value):
+    if value is None:
+        return None
+    return datetime.datetime.fromtimestamp(value, datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+@jobs_bp.cli.command('flush')
+def flush_jobs():
+    """Apply every queued write-behind job now."""
+    click.echo(f'{flush(current_app)} jobs applied')
+
+
+@jobs_bp.route('/jobs/<job_id>', methods=['GET'])
+@spec.validate(resp=Response(HTTP_200=Job, HTTP_404=JsonResponseMessage))
+def get_job(job_id: str):
+    """State of a write accepted with 202."""
+    job = job_queue.get(job_id)
+    if job is None:
+        msg = 'Tarefa não encontrada'
+        return JsonResponseMessage(status_code=404, message_type='info', message=msg).dict(), 404
+
+    job['created_at'] = format_time(job['created_at'])
+    job['finished_at'] = format_time(job['finished_at'])
+    return jsonify(job), 200
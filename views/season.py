@@ -6,36 +6,51 @@ from models import Seasons, Season, JsonResponseMessage
 from api_spec import spec
 from sqlalchemy import text
 from database import db
+from utils.cache import read_cache
+from utils.etag import etag, cache_version
+from utils.serialization import row_mapper
+from utils.summary import rebuild_season_summary
 
 season_bp = Blueprint('season', __name__)
 spec.register(season_bp)
+SEASON_COLS = tuple(Season.__fields__)
+
+
+@season_bp.cli.command('rebuild-summary')
+def rebuild_summary():
+    """Recount season_summary from the episode table."""
+    rebuild_season_summary()
+    db.session.commit()
 
 @season_bp.route('/anime/<int:anime_id>/season', methods=['GET'])
+@etag('episode:{anime_id}')
 @spec.validate(resp=Response(HTTP_200=Seasons, 
                              HTTP_404=JsonResponseMessage,
                              HTTP_422=JsonResponseMessage,
                              HTTP_500=JsonResponseMessage,
                              HTTP_400=JsonResponseMessage))
 def list_seasons(anime_id: int):
-    try:
+    def load():
         query_result = db.session.execute(
             text(
-                'SELECT season, count(*) as episodes \
-                    FROM episode WHERE anime_id = :aid GROUP BY season'
+                'SELECT season, episodes FROM season_summary \
+                    WHERE anime_id = :aid ORDER BY season'
             ), 
             {'aid': anime_id},
         ).fetchall()
+        return list(map(row_mapper(SEASON_COLS), query_result)) or None
 
-        if not query_result:
+    try:
+        resp = read_cache.fetch(f'seasons:{anime_id}', load, cache_version())
+
+        if not resp:
             return JsonResponseMessage(
             status_code=404, 
             message_type='info', 
             message='Há episódios para exibir'
         ).dict(), 404
         
-        columns = list(Season.schema()['properties'].keys())
-        resp = [dict(zip(columns, row)) for row in query_result]
-        return jsonify(Seasons(seasons=resp).dict()), 200
+        return jsonify({'seasons': resp}), 200
 
     except DataError as e:
         return JsonResponseMessage(
@@ -60,6 +75,7 @@ def list_seasons(anime_id: int):
 
 
 @season_bp.route('/anime/<int:anime_id>/season/<int:season_num>', methods=['GET'])
+@etag('episode:{anime_id}')
 @spec.validate(resp=Response(HTTP_200=Seasons, 
                              HTTP_404=JsonResponseMessage, 
                              HTTP_422=JsonResponseMessage, 
@@ -69,11 +85,10 @@ def get_season(anime_id: int, season_num: int):
     try:
         query_result = db.session.execute(
             text(
-                'SELECT season, count(*) as episodes \
-                    FROM episode WHERE anime_id = :aid and season = :s \
-                        GROUP BY season'
+                'SELECT season, episodes FROM season_summary \
+                    WHERE anime_id = :aid and season = :s'
             ), 
-            {'aid': anime_id, 's': str(season_num)}
+            {'aid': anime_id, 's': season_num}
         ).fetchall()
 
         if not query_result:
@@ -83,9 +98,8 @@ def get_season(anime_id: int, season_num: int):
             message='Não há episódio para exibir'
         ).dict(), 404
         
-        columns = list(Season.schema()['properties'].keys())
-        resp = [dict(zip(columns, row)) for row in query_result]
-        return jsonify(Seasons(seasons=resp).dict()), 200
+        resp = list(map(row_mapper(SEASON_COLS), query_result))
+        return jsonify({'seasons': resp}), 200
 
     except DataError as e:
         return JsonResponseMessage(